@@ -0,0 +1,440 @@
+from storage import MemoryStorage
+import save_data
+import tracemalloc
+import tempfile
+import threading
+import datetime
+import re
+import random
+import json
+import time
+import sys
+import os
+import logging
+import argparse
+
+# Configurações
+video_sizes = [1000, 10000, 100000]  # tamanhos das playlists sintéticas
+history_days = 3650  # dias de histórico (10 anos)
+duration_corpus = 1000000  # durações do micro-benchmark de soma
+api_latency = 0.0  # segundos de latência simulada por chamada à API
+slow_read_timeout = 0.2  # segundos; limite de leitura da página no teste com armazenamento lento
+timeout_margin = 0.5  # segundos além do limite aceitos nesse teste
+seed = 42
+
+FLASK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "frontend-flask")
+
+
+# -- fake storage --
+class SlowStorage:
+    """Armazenamento que demora delay segundos em cada leitura antes de delegar a db."""
+
+    def __init__(self, db, delay):
+        self.db = db
+        self.delay = delay
+
+    def get_documents(self, keys):
+        time.sleep(self.delay)
+        return self.db.get_documents(keys)
+
+
+# -- fake youtube --
+class FakeRequest:
+
+    def __init__(self, client, resource, params):
+        self.client = client
+        self.resource = resource
+        self.params = params
+
+    def execute(self, http=None, num_retries=0):
+        with self.client.lock:
+            self.client.calls[self.resource] += 1
+        if self.client.latency:
+            time.sleep(self.client.latency)
+        return getattr(self.client, f"_{self.resource}")(**self.params)
+
+
+class FakeResource:
+
+    def __init__(self, client, resource):
+        self.client = client
+        self.resource = resource
+
+    def list(self, **params):
+        return FakeRequest(self.client, self.resource, params)
+
+    def list_next(self, request, response):
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            return
+        return FakeRequest(self.client, self.resource, {**request.params, "pageToken": page_token})
+
+
+class FakeYouTube:
+    """Cliente falso da YouTube Data API com uma playlist sintética.
+
+    Responde playlistItems().list e videos().list paginados como a API real
+    (até 50 itens por página), com latência opcional e contagem de chamadas.
+    """
+
+    def __init__(self, video_count, latency=0.0, seed=seed):
+        rng = random.Random(seed)
+        self.video_ids = [f"vid{i:08d}" for i in range(video_count)]
+        self.durations = {video_id: random_duration(rng) for video_id in self.video_ids}
+        self.latency = latency
+        self.calls = {"playlistItems": 0, "videos": 0}
+        self.lock = threading.Lock()
+
+    def playlistItems(self):
+        return FakeResource(self, "playlistItems")
+
+    def videos(self):
+        return FakeResource(self, "videos")
+
+    def _playlistItems(self, part, playlistId, maxResults, pageToken=None):
+        start = int(pageToken or 0)
+        page = self.video_ids[start:start + maxResults]
+        response = {"items": [{"contentDetails": {"videoId": video_id}} for video_id in page]}
+        if start + maxResults < len(self.video_ids):
+            response["nextPageToken"] = str(start + maxResults)
+        return response
+
+    def _videos(self, part, id):
+        return {"items": [
+            {"id": video_id, "contentDetails": {"duration": self.durations[video_id]}}
+            for video_id in id.split(",") if video_id in self.durations
+        ]}
+
+def random_duration(rng):
+    # Mistura formatos reais: vídeos curtos, longos, com dias e transmissões ao vivo (P0D)
+    kind = rng.random()
+    if kind < 0.01:
+        return "P0D"
+    if kind < 0.02:
+        return f"P{rng.randint(1, 3)}DT{rng.randint(0, 23)}H{rng.randint(0, 59)}M"
+    if kind < 0.3:
+        return f"PT{rng.randint(1, 59)}M{rng.randint(0, 59)}S"
+    if kind < 0.4:
+        return f"PT{rng.randint(1, 59)}S"
+    return f"PT{rng.randint(1, 3)}H{rng.randint(0, 59)}M{rng.randint(0, 59)}S"
+
+
+# -- synthetic history --
+def seed_history(db, days, end_date):
+    # Um registro por dia terminando em end_date, com pequenas variações diárias
+    rng = random.Random(seed)
+    video_count = 100
+    total_minutes = 6000
+    writes = []
+    start = end_date - datetime.timedelta(days=days - 1)
+    for offset in range(days):
+        video_count = max(1, video_count + rng.randint(-3, 5))
+        total_minutes = max(1, total_minutes + rng.randint(-150, 300))
+        date = (start + datetime.timedelta(days=offset)).isoformat()
+        writes.append(("playlist_data", date, {"video_count": video_count, "total_minutes": total_minutes}, False))
+    db.commit(writes)
+
+
+# -- measuring --
+def measure(name, function, counters=None, memory=True):
+    # Executa a etapa uma vez para medir o tempo e, se pedido, outra sob tracemalloc
+    # para o pico de memória (o rastreamento deixaria o tempo artificialmente lento)
+    before = dict(counters()) if counters else {}
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    after = dict(counters()) if counters else {}
+    calls = {key: after[key] - before.get(key, 0) for key in after}
+
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            function()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    row = {"stage": name, "seconds": round(elapsed, 4), "calls": calls, "peak_kib": round(peak / 1024, 1) if peak is not None else None}
+    print(format_row(row), flush=True)
+    return row, result
+
+def format_row(row):
+    calls = ", ".join(f"{key}={value}" for key, value in row["calls"].items() if value) or "-"
+    peak = f"{row['peak_kib']:>12,.1f}" if row["peak_kib"] is not None else f"{'-':>12}"
+    return f"{row['stage']:<44} {row['seconds'] * 1000:>12,.1f} {peak}  {calls}"
+
+def print_header(title):
+    print(f"\n{title}")
+    print(f"{'etapa':<44} {'tempo (ms)':>12} {'pico (KiB)':>12}  chamadas")
+
+
+# -- benchmarks --
+def bench_videos(video_count, latency, memory):
+    print_header(f"Playlist com {video_count} vídeos (latência {latency * 1000:.0f} ms)")
+    youtube = FakeYouTube(video_count, latency)
+    rows = []
+
+    def counters():
+        return youtube.calls
+
+    # Totais esperados, calculados direto das durações da playlist falsa
+    expected = (video_count, save_data.total_duration_minutes(youtube.durations.values())[0])
+
+    # Sem cache de durações: todas as durações vêm da API
+    for workers in (1, save_data.duration_workers):
+        row, result = measure(
+            f"get_data (sem cache, {workers} lote(s))",
+            lambda: save_data.get_data(None, youtube, "bench", workers=workers, durations={}),
+            counters, memory
+        )
+        rows.append(row)
+        check_totals(row["stage"], result, expected)
+
+    # Com todas as durações conhecidas: só a listagem da playlist vai para a API
+    durations = dict(youtube.durations)
+    row, cached = measure(
+        "get_data (cache completo)",
+        lambda: save_data.get_data(None, youtube, "bench", durations=dict(durations)),
+        counters, memory
+    )
+    rows.append(row)
+    check_totals(row["stage"], cached, expected)
+
+    # Playlist inalterada: com o cache completo nenhuma duração é buscada e os totais anteriores valem
+    previous = {"date": "anterior", **result, "duration_method": save_data.duration_method}
+    row, unchanged = measure(
+        "get_data (impressão digital igual)",
+        lambda: save_data.get_data(None, youtube, "bench", previous=previous, durations=dict(durations)),
+        counters, memory
+    )
+    rows.append(row)
+    check_totals(row["stage"], unchanged, expected)
+    if unchanged["collect_path"] != "fast":
+        raise RuntimeError(f"{row['stage']}: a impressão digital não foi reaproveitada")
+
+    values = list(youtube.durations.values())
+    row, _ = measure("total_duration_minutes", lambda: save_data.total_duration_minutes(values), memory=memory)
+    rows.append(row)
+
+    return {"videos": video_count, "stages": rows}
+
+def bench_durations(count, memory):
+    print_header(f"Soma de {count} durações")
+    rng = random.Random(seed)
+    values = [random_duration(rng) for _ in range(count)]
+    rows = []
+
+    row, legacy_minutes = measure(
+        "minutos por vídeo (implementação anterior)",
+        lambda: sum(legacy_parse_duration_to_minutes(duration) for duration in values),
+        memory=memory
+    )
+    rows.append(row)
+
+    def exact():
+        save_data.parse_duration_to_seconds.cache_clear()
+        return save_data.total_duration_minutes(values)
+
+    row, (minutes, _) = measure("total_duration_minutes (segundos exatos)", exact, memory=memory)
+    rows.append(row)
+
+    print(f"{'diferença nos totais (minutos)':<44} {minutes - legacy_minutes:>12,}")
+    return {"durations": count, "legacy_minutes": legacy_minutes, "minutes": minutes, "stages": rows}
+
+def legacy_parse_duration_to_minutes(duration):
+    # Versão anterior a total_duration_minutes, mantida só para comparação:
+    # recompila o padrão a cada chamada e descarta os segundos de cada vídeo
+    match = re.match(r"P(?:(\d+)D)?T?(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?", duration)
+    if not match:
+        raise ValueError("Formato de duração inválido.")
+    days, hours, minutes, seconds = (int(value) if value else 0 for value in match.groups())
+    return days * 1440 + hours * 60 + minutes + seconds // 60
+
+def bench_history(days, memory):
+    print_header(f"Histórico de {days} dias")
+    db = MemoryStorage()
+    end_date = datetime.date.today()
+    seed_history(db, days, end_date)
+    save_data.TODAY_STRING = end_date.isoformat()
+    rows = []
+
+    def counters():
+        return {"leituras": db.reads, "escritas": db.writes}
+
+    row, data = measure("fetch_data (histórico completo)", lambda: save_data.fetch_data(db), counters, memory)
+    rows.append(row)
+
+    row, _ = measure("fetch_data (últimos 28 dias)", lambda: save_data.fetch_data(db, days=save_data.month_points), counters, memory)
+    rows.append(row)
+
+    row, (full_data, _) = measure("parse_data", lambda: save_data.parse_data(data), memory=memory)
+    rows.append(row)
+
+    video_counts = [item["video_count"] for item in data]
+    total_minutes = [item["total_minutes"] for item in data]
+    row, _ = measure(
+        "calculate_changes (2 métricas)",
+        lambda: save_data.calculate_all_changes({"vídeos": video_counts, "minutos": total_minutes}),
+        memory=memory
+    )
+    rows.append(row)
+
+    # Derivados de uma execução noturna; a primeira grava o histórico compactado inteiro
+    def derive():
+        save_data.begin_writes()
+        try:
+            save_data.parse_and_save_data(db)
+            aggregates = save_data.update_and_save_aggregates(db)
+            save_data.calc_and_save_aggregates(db, aggregates)
+            save_data.upload_status(db, "final_result", f"Dados para {save_data.TODAY_STRING} salvos.", True)
+        finally:
+            save_data.flush_writes(db)
+
+    row, _ = measure("execução noturna (derivados)", derive, counters, memory=False)
+    rows.append(row)
+    row, _ = measure("execução noturna (incremental)", derive, counters, memory)
+    rows.append(row)
+
+    rows.extend(bench_dashboard(db, full_data, counters, memory))
+
+    return {"days": days, "stages": rows}
+
+def bench_dashboard(db, full_data, counters, memory):
+    sys.path.append(FLASK_DIR)
+    import fetch_data as dashboard
+
+    dashboard.DB = db
+    client = dashboard.app.test_client()
+    dates = [point["x"] for point in full_data["video_count_points"]]
+    values = [point["y"] for point in full_data["video_count_points"]]
+    rows = []
+
+    row, _ = measure(
+        "generate_graph (histórico completo)",
+        lambda: dashboard.generate_graph(dates, values, "Vídeos", "#1f77b4"),
+        memory=memory
+    )
+    rows.append(row)
+
+    def reset_caches():
+        dashboard.DATA_CACHE.update({"playlists": {}, "version": None, "checked_at": 0.0})
+        dashboard.GRAPH_CACHE.update({"version": None, "graphs": {}})
+        dashboard.HISTORY_CACHE.update({"version": None, "chunks": {}})
+        dashboard.COMPRESSED_CACHE.clear()
+
+    def cold_request():
+        reset_caches()
+        return get_ok(client, "/")
+
+    # O pool de processos dos gráficos sobe na primeira página; fica fora da medição
+    cold_request()
+    row, _ = measure("Flask / (caches vazios)", cold_request, counters, memory)
+    rows.append(row)
+    row, response = measure("Flask / (caches quentes)", lambda: get_ok(client, "/"), counters, memory)
+    rows.append(row)
+    row, _ = measure(
+        "Flask / (If-None-Match)",
+        lambda: client.get("/", headers={"If-None-Match": response.headers["ETag"]}),
+        counters, memory
+    )
+    rows.append(row)
+    row, _ = measure(
+        "Flask /api/points (histórico completo)",
+        lambda: get_ok(client, f"/api/points?from={dates[0]}&to={dates[-1]}"),
+        counters, memory
+    )
+    rows.append(row)
+    check_downsample(client, dates)
+
+    # Leitura bem mais lenta que o limite: a página tem de sair no tempo limite, com os valores padrão
+    timeouts = dict(dashboard.part_timeouts)
+    dashboard.part_timeouts["documents"] = slow_read_timeout
+    dashboard.DB = SlowStorage(db, slow_read_timeout * 5)
+    try:
+        row, response = measure("Flask / (armazenamento lento)", cold_request, counters, memory=False)
+    finally:
+        dashboard.DB = db
+        dashboard.part_timeouts.update(timeouts)
+    rows.append(row)
+    check_timeout(row, response, slow_read_timeout)
+
+    return rows
+
+def check_totals(stage, result, expected):
+    # Modos sequencial, em paralelo e com cache precisam chegar aos mesmos totais
+    totals = (result["video_count"], result["total_minutes"]) if result else None
+    if totals != expected:
+        raise RuntimeError(f"{stage}: totais {totals}, esperado {expected}")
+
+def check_downsample(client, dates):
+    # Intervalos curtos com points pequeno: nunca mais pontos que o pedido, e o último dia sempre presente
+    for points, days in ((1, 2), (2, 2), (1, 5), (2, 5), (3, 5)):
+        path = f"/api/points?from={dates[0]}&to={dates[days - 1]}&points={points}"
+        series = get_ok(client, path).get_json()
+        if len(series["dates"]) != min(points, days) or series["dates"][-1] != dates[days - 1]:
+            raise RuntimeError(f"{path}: {len(series['dates'])} pontos, esperado {min(points, days)}")
+
+def check_timeout(row, response, timeout):
+    # Uma parte lenta não pode atrasar a página além do seu limite de tempo
+    if row["seconds"] > timeout + timeout_margin:
+        raise RuntimeError(f"{row['stage']}: {row['seconds']} s, limite de {timeout} s")
+    if response.headers.get("Cache-Control") != "no-store":
+        raise RuntimeError(f"{row['stage']}: página com valores padrão sem Cache-Control: no-store")
+
+def get_ok(client, path):
+    response = client.get(path)
+    if response.status_code != 200:
+        raise RuntimeError(f"{path} respondeu {response.status_code}")
+    return response
+
+
+# -- main functions --
+def parse_args():
+    parser = argparse.ArgumentParser(description="Mede as etapas do backend e do dashboard com dados sintéticos.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=video_sizes,
+        help="tamanhos das playlists sintéticas")
+    parser.add_argument("--days", type=int, default=history_days,
+        help="dias de histórico sintético")
+    parser.add_argument("--durations", type=int, default=duration_corpus,
+        help="durações do micro-benchmark de soma (0 = não roda)")
+    parser.add_argument("--latency", type=float, default=api_latency,
+        help="latência simulada por chamada à API, em segundos")
+    parser.add_argument("--api-rate", type=float, default=None,
+        help="aplica o limite de chamadas por segundo do backend (desligado por padrão)")
+    parser.add_argument("--no-memory", action="store_true",
+        help="não mede o pico de memória (cada etapa roda só uma vez)")
+    parser.add_argument("--json", metavar="ARQUIVO",
+        help="também grava os resultados em JSON")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    memory = not args.no_memory
+
+    # As mensagens forçadas das etapas poluiriam a tabela
+    logging.getLogger().setLevel(logging.WARNING)
+
+    results = {"videos": [], "durations": None, "history": None}
+    # Checkpoints num diretório descartável: o custo de gravá-los entra na medida
+    # sem tocar nos checkpoints reais do backend
+    with tempfile.TemporaryDirectory() as directory:
+        save_data.checkpoint_path = os.path.join(directory, "checkpoints.sqlite")
+        save_data.quota_path = os.path.join(directory, "quota.json")
+        # Mede o código, não o limite de taxa nem o orçamento de cota (salvo se pedido)
+        save_data.api_rate = args.api_rate
+        save_data.quota_budget = None
+        for video_count in args.sizes:
+            results["videos"].append(bench_videos(video_count, args.latency, memory))
+    if args.durations:
+        results["durations"] = bench_durations(args.durations, memory)
+    if args.days:
+        results["history"] = bench_history(args.days, memory)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\nResultados gravados em '{args.json}'.")
+
+if __name__ == "__main__":
+    main()
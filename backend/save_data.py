@@ -1,20 +1,69 @@
-from googleapiclient.discovery import build
+import time
+
+IMPORT_START = time.perf_counter()  # início da carga do módulo, para medir a partida
+
 from dotenv import load_dotenv
-from google.cloud import firestore
+from storage import (
+    STARTUP, lazy_import, FirestoreStorage, SQLiteStorage, merge_fields, write_snapshot,
+    parse_playlist_ids, parsed_document, history_columns, history_chunk_id, encode_history_chunk, decode_history_chunk
+)
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from functools import wraps, lru_cache
+from collections import Counter
 import tempfile
-import pytz
+import threading
+import sqlite3
+import hashlib
+import json
+import zlib
+import random
 import os
 import re
-import time
 import logging
 import datetime
+import argparse
 
 # Configurações
 debug = False
 debug_time = 2
+duration_workers = 4  # lotes de durações buscados em paralelo (1 = modo sequencial)
+duration_method = "seconds"  # gravado com cada total; registros de outro método não são reaproveitados
+month_points = 28  # dias exibidos no gráfico do mês
+history_chunk_size = 1000  # dias por documento do histórico compactado
+membership_keyframe_interval = 30  # dias entre snapshots completos dos vídeos da playlist
+membership_part_size = 20000  # IDs por documento de um snapshot completo
+write_batch_limit = 500  # escritas por lote do Firestore
+write_batch_bytes = 8 * 1024 * 1024  # tamanho aproximado máximo de um lote (o Firestore aceita até 10 MiB)
+change_windows = {"week": 7, "month": 28}  # janelas (em dias) das estatísticas de mudança
+duration_cache_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "durations.sqlite")
+membership_cache_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "membership.sqlite")
+checkpoint_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "checkpoints.sqlite")
+metrics_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs", "metrics.jsonl")
+quota_costs = {"playlistItems": 1, "videos": 1}  # unidades de cota por chamada de list
+quota_budget = 9000  # unidades por dia que as execuções podem gastar (a cota padrão é 10.000; None desliga)
+quota_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "quota.json")
+snapshot_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "dashboard.snapshot")  # lido pelo dashboard; SNAPSHOT_PATH substitui, vazio desliga
+snapshot_documents = ("points_array", "calcs", "history_index", "rollups")  # documentos de parsed_data no snapshot
+api_rate = 20  # chamadas por segundo à API, somando todas as threads (None desliga o limite)
+api_burst = 20  # chamadas que podem sair de uma vez antes do limite de taxa valer
+api_max_retries = 5  # novas tentativas para erros transitórios (429, 5xx, falhas de conexão)
+api_backoff = 1.0  # espera base, em segundos, dobrada a cada nova tentativa (com jitter)
+api_backoff_max = 32.0
+
+try:
+    TIMEZONE = ZoneInfo("America/Sao_Paulo")
+    QUOTA_TIMEZONE = ZoneInfo("America/Los_Angeles")  # a cota da API reinicia à meia-noite do Pacífico
+except ZoneInfoNotFoundError:  # sistemas sem base de fusos (Windows sem o pacote tzdata)
+    import pytz
+    TIMEZONE = pytz.timezone("America/Sao_Paulo")
+    QUOTA_TIMEZONE = pytz.timezone("America/Los_Angeles")
 
-TIMEZONE = pytz.timezone("America/Sao_Paulo")
 TODAY_STRING = ""
+WRITE_BUFFER = None
+METRICS = {"spans": [], "stack": [], "api_calls": {}, "api_seconds": {}, "debug_sleep": 0.0}
+RATE_LIMITER = {"tokens": float(api_burst), "updated": None, "waited": 0.0}  # waited: soma das esperas de todas as threads
+QUOTA = {"day": None, "used_before": 0, "used": 0, "retries": {}}
 
 logging.basicConfig(level=logging.INFO,
     format='%(asctime)s - %(message)s',
@@ -24,14 +73,220 @@ logging.basicConfig(level=logging.INFO,
 )
 logger = logging.getLogger()
 
+_thread_state = threading.local()
+metrics_lock = threading.Lock()
+api_lock = threading.Lock()
+
 def message(text, forced=False):
     if debug or forced:
         logger.info(text)
     if debug:
         time.sleep(debug_time)
+        # A pausa do modo debug é descontada das durações medidas
+        with metrics_lock:
+            METRICS["debug_sleep"] += debug_time
     return text
 
 
+# -- metrics --
+def startup_report():
+    imports = ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in STARTUP["imports"].items())
+    return f"Módulo carregado em {STARTUP['module_seconds'] * 1000:.0f} ms; importações sob demanda: {imports or 'nenhuma'}."
+
+def reset_metrics():
+    global METRICS
+    METRICS = {"spans": [], "stack": [], "api_calls": {}, "api_seconds": {}, "debug_sleep": 0.0}
+
+def metrics_snapshot():
+    with metrics_lock:
+        return time.perf_counter(), METRICS["debug_sleep"], dict(METRICS["api_calls"])
+
+def quota_units(api_calls):
+    return sum(quota_costs.get(resource, 1) * count for resource, count in api_calls.items())
+
+def traced(function):
+    # Registra uma etapa: duração, chamadas à API e cota gastas dentro dela e o resultado
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        span = {
+            "name": function.__name__,
+            "parent": METRICS["stack"][-1]["name"] if METRICS["stack"] else None,
+            "started_at": datetime.datetime.now(TIMEZONE).isoformat(timespec="milliseconds"),
+        }
+        METRICS["stack"].append(span)
+        start, sleep_start, calls_start = metrics_snapshot()
+        status = "error"
+        try:
+            result = function(*args, **kwargs)
+            status = "ok" if result else "empty"
+            return result
+        finally:
+            end, sleep_end, calls_end = metrics_snapshot()
+            api_calls = {
+                resource: count - calls_start.get(resource, 0)
+                for resource, count in calls_end.items() if count != calls_start.get(resource, 0)
+            }
+            METRICS["stack"].pop()
+            span.update({
+                "seconds": round(end - start - (sleep_end - sleep_start), 4),
+                "status": status,
+                "api_calls": api_calls,
+                "quota_units": quota_units(api_calls),
+            })
+            METRICS["spans"].append(span)
+    return wrapper
+
+def annotate_span(**fields):
+    # Acrescenta contadores à etapa em andamento (páginas, lotes, escritas...)
+    if METRICS["stack"]:
+        span = METRICS["stack"][-1]
+        for key, value in fields.items():
+            span[key] = span.get(key, 0) + value if isinstance(value, (int, float)) else value
+
+def record_api_call(resource, seconds):
+    with metrics_lock:
+        METRICS["api_calls"][resource] = METRICS["api_calls"].get(resource, 0) + 1
+        METRICS["api_seconds"][resource] = METRICS["api_seconds"].get(resource, 0.0) + seconds
+
+def write_metrics(path, started_at, total_seconds):
+    # Uma linha JSON por etapa e uma de resumo da execução
+    run_id = f"{TODAY_STRING}T{started_at}"
+    api_calls = dict(METRICS["api_calls"])
+    lines = [{"type": "span", "run": run_id, **span} for span in METRICS["spans"]]
+    lines.append({
+        "type": "run",
+        "run": run_id,
+        "seconds": round(total_seconds - METRICS["debug_sleep"], 4),
+        "api_calls": api_calls,
+        "api_seconds": {resource: round(seconds, 4) for resource, seconds in METRICS["api_seconds"].items()},
+        "quota_units": quota_units(api_calls),
+        "quota_used_today": QUOTA["used_before"] + QUOTA["used"],
+        "api_retries": dict(QUOTA["retries"]),
+        "rate_limit_wait_seconds": round(RATE_LIMITER["waited"], 4),
+        "startup": STARTUP,
+    })
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            for line in lines:
+                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+        message(f"Métricas da execução gravadas em '{path}' ({quota_units(api_calls)} unidades de cota).", True)
+    except Exception as e:
+        message(f"Erro ao gravar as métricas: {str(e)}", True)
+
+
+# -- youtube api --
+class QuotaExceededError(Exception):
+    pass
+
+def execute_api_request(resource, api_request, http=None):
+    # Toda chamada à YouTube Data API passa por aqui: limite de taxa, orçamento de cota,
+    # novas tentativas com espera exponencial e contagem nas métricas
+    for attempt in range(api_max_retries + 1):
+        reserve_quota(resource)
+        acquire_rate_limit()
+
+        try:
+            return timed_execute(resource, api_request, http)
+        except Exception as e:
+            reason = api_error_reason(e)
+            if reason == "quota":
+                raise QuotaExceededError(f"A API recusou a chamada por falta de cota: {str(e)}") from e
+            if reason != "retry" or attempt == api_max_retries:
+                raise
+
+            delay = min(api_backoff_max, api_backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+            with api_lock:
+                QUOTA["retries"][resource] = QUOTA["retries"].get(resource, 0) + 1
+            message(f"Erro transitório em {resource} ({str(e)[:120]}), nova tentativa em {delay:.1f} s...", True)
+            time.sleep(delay)
+
+def timed_execute(resource, api_request, http=None):
+    # Só o tempo da chamada entra nas métricas; a espera antes de uma nova tentativa fica de fora
+    start = time.perf_counter()
+    try:
+        return api_request.execute(http=http)
+    finally:
+        record_api_call(resource, time.perf_counter() - start)
+
+def api_error_reason(error):
+    # "quota" para cota esgotada, "retry" para erros transitórios, None para os demais
+    status = getattr(getattr(error, "resp", None), "status", None)
+    if status is None:
+        return "retry" if isinstance(error, (ConnectionError, TimeoutError)) else None
+
+    content = getattr(error, "content", b"")
+    content = content.decode("utf-8", "replace") if isinstance(content, bytes) else str(content)
+    if status == 403 and ("quotaExceeded" in content or "dailyLimitExceeded" in content):
+        return "quota"
+    rate_limited = "rateLimitExceeded" in content or "RateLimitExceeded" in content
+    if status == 429 or status >= 500 or (status == 403 and rate_limited):
+        return "retry"
+    return None
+
+def acquire_rate_limit():
+    # Balde de fichas compartilhado entre as threads: api_rate fichas por segundo, até api_burst
+    if not api_rate:
+        return
+
+    while True:
+        with api_lock:
+            now = time.monotonic()
+            updated = RATE_LIMITER["updated"] if RATE_LIMITER["updated"] is not None else now
+            RATE_LIMITER["tokens"] = min(api_burst, RATE_LIMITER["tokens"] + (now - updated) * api_rate)
+            RATE_LIMITER["updated"] = now
+            if RATE_LIMITER["tokens"] >= 1:
+                RATE_LIMITER["tokens"] -= 1
+                return
+            wait_time = (1 - RATE_LIMITER["tokens"]) / api_rate
+            RATE_LIMITER["waited"] += wait_time
+        time.sleep(wait_time)
+
+def reserve_quota(resource):
+    # Recusa a chamada antes de enviá-la se ela passaria do orçamento do dia
+    cost = quota_costs.get(resource, 1)
+    day = quota_day()
+    with api_lock:
+        if QUOTA["day"] != day:
+            QUOTA.update({"day": day, "used_before": load_quota_usage(quota_path, day), "used": 0})
+        if quota_budget is not None and QUOTA["used_before"] + QUOTA["used"] + cost > quota_budget:
+            raise QuotaExceededError(
+                f"Orçamento diário de {quota_budget} unidades de cota atingido "
+                f"({QUOTA['used_before'] + QUOTA['used']} usadas hoje)."
+            )
+        QUOTA["used"] += cost
+
+def quota_day():
+    # O dia da cota segue o horário do Pacífico, não o dia dos dados (São Paulo)
+    return datetime.datetime.now(QUOTA_TIMEZONE).strftime('%Y-%m-%d')
+
+def load_quota_usage(path, day):
+    # Unidades já gastas no dia da cota por execuções anteriores (tentativas repetidas no mesmo dia)
+    try:
+        with open(path, encoding="utf-8") as f:
+            usage = json.load(f)
+        return usage["units"] if usage.get("day") == day else 0
+    except FileNotFoundError:
+        return 0
+    except Exception as e:
+        message(f"Erro ao ler o uso de cota, considerando zero: {str(e)}", True)
+        return 0
+
+def save_quota_usage(path):
+    if not path or QUOTA["day"] is None:
+        return
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"day": QUOTA["day"], "units": QUOTA["used_before"] + QUOTA["used"]}, f)
+        os.replace(temp_path, path)
+    except Exception as e:
+        message(f"Erro ao salvar o uso de cota: {str(e)}", True)
+
+
 # -- init --
 def set_day():
     message("Definindo data atual...")
@@ -44,10 +299,12 @@ def load_keys():
     
     load_dotenv()
     playlist_id = os.getenv('PLAYLIST_ID')
+    playlist_ids = parse_playlist_ids(os.getenv('PLAYLIST_IDS', ''))
     youtube_api_key = os.getenv('YOUTUBE_API_KEY')
     firebase_credentials_path = os.getenv('FIREBASE_CREDENTIALS_PATH')
+    sqlite_path = os.getenv('SQLITE_PATH')
 
-    return playlist_id, youtube_api_key, firebase_credentials_path
+    return playlist_id, playlist_ids, youtube_api_key, firebase_credentials_path, sqlite_path
 
 def check_environment(firebase_credentials_info):
     message("Checando se a info é caminho (arquivo local) ou info json (variável secreta)")
@@ -75,7 +332,8 @@ def init_firestore(firebase_credentials_path):
     message("Conectando ao Firestore...")
 
     try:
-        db = firestore.Client.from_service_account_json(firebase_credentials_path)
+        firestore = lazy_import("google.cloud.firestore")
+        db = FirestoreStorage(firestore.Client.from_service_account_json(firebase_credentials_path))
         message("Conexão ao Firestore estabelecida.")
     except Exception as e:
         message(f"Erro ao conectar no Firestore: {str(e)}")
@@ -83,24 +341,63 @@ def init_firestore(firebase_credentials_path):
 
     return db
 
+def init_sqlite(sqlite_path):
+    message(f"Abrindo banco local SQLite em '{sqlite_path}'...")
+
+    try:
+        db = SQLiteStorage(sqlite_path)
+        message("Banco local aberto.")
+    except Exception as e:
+        message(f"Erro ao abrir o banco local: {str(e)}")
+        return
+
+    return db
+
 
 # -- uploads --
-def upload_data(db, video_count, total_minutes):
+@traced
+def upload_data(db, video_count, total_minutes, fingerprint=None, membership=None):
     message(f"Salvando dados para {TODAY_STRING}: {video_count} vídeos, {total_minutes} minutos...")
 
     try:
-        doc_ref = db.collection("playlist_data").document(TODAY_STRING)
-        doc_ref.set({
+        write_document(db, "playlist_data", TODAY_STRING, {
             "video_count": video_count,
-            "total_minutes": total_minutes
-        }, merge=True)
+            "total_minutes": total_minutes,
+            "fingerprint": fingerprint,
+            "duration_method": duration_method,
+            **(membership or {})
+        })
         return message(f"Dados para {TODAY_STRING} salvos.", True)
     
     except Exception as e:
         message(f"Erro ao salvar dados: {str(e)}", True)
         return
 
-def upload_status(db, title, status, success=False):
+@traced
+def upload_playlists_data(db, results):
+    message(f"Salvando dados de {len(results)} playlists para {TODAY_STRING}...")
+
+    try:
+        # Um único documento por dia, com um mapa por playlist
+        write_document(db, "playlist_data", TODAY_STRING, {
+            "playlists": {
+                playlist_id: {
+                    "video_count": result["video_count"],
+                    "total_minutes": result["total_minutes"],
+                    "fingerprint": result["fingerprint"],
+                    "duration_method": duration_method,
+                    **result.get("membership", {})
+                }
+                for playlist_id, result in results.items()
+            }
+        })
+        return message(f"Dados de {len(results)} playlists para {TODAY_STRING} salvos.", True)
+
+    except Exception as e:
+        message(f"Erro ao salvar dados das playlists: {str(e)}", True)
+        return
+
+def upload_status(db, title, status, success=False, extra=None):
     message(f"Salvando status '{title}'...")
 
     try:
@@ -109,39 +406,133 @@ def upload_status(db, title, status, success=False):
         timestamp = datetime.datetime.now(TIMEZONE)
         formatted_time = timestamp.strftime('%d/%m/%Y %H:%M:%S')
 
-        doc_ref = db.collection("status").document("playlist_status")
-        doc_ref.set({
+        write_document(db, "status", "playlist_status", {
             title: status,
             last_title: formatted_time,
-            "success": success
-        }, merge=True)
+            "success": success,
+            **(extra or {})
+        })
         message(f"Status salvo.")
 
     except Exception as e:
         message(f"Erro ao salvar status: {str(e)}")
 
+def bump_data_version(db):
+    # Derivados regravados fora da execução diária (backfill, reconstruções): o dashboard
+    # troca de versão pelo status, então data_version avisa que os documentos mudaram
+    message("Atualizando a versão dos dados...")
+
+    try:
+        write_document(db, "status", "playlist_status", {"data_version": time.time_ns()})
+    except Exception as e:
+        message(f"Erro ao atualizar a versão dos dados: {str(e)}", True)
+
 def upload_calc(db, collection, document, title, data):
     message(f"Salvando '{title}' em '{collection}/{document}'...")
 
     try:
-        doc_ref = db.collection(collection).document(document)
-        doc_ref.set({
+        write_document(db, collection, document, {
             title: data
-        }, merge=True)
+        })
         message(f"Dados '{title}' salvos no Firestore.")
 
     except Exception as e:
         message(f"Erro salvar dados '{title}': {str(e)}")
 
 
+# -- write buffer --
+def begin_writes():
+    # A partir daqui as escritas ficam retidas e vão juntas no flush_writes
+    global WRITE_BUFFER
+    WRITE_BUFFER = {}
+
+def write_document(db, collection, document, data, merge=True):
+    if WRITE_BUFFER is None:
+        db.set_document(collection, document, data, merge)
+        return
+
+    # Escritas no mesmo documento são combinadas em uma só, como o Firestore faria
+    key = (collection, document)
+    if key in WRITE_BUFFER and merge:
+        merge_fields(WRITE_BUFFER[key][0], data)
+    else:
+        WRITE_BUFFER[key] = (merge_fields({}, data), merge)
+
+def buffered_documents(collection):
+    # Documentos ainda não gravados de uma coleção, para que as leituras da própria execução os vejam
+    if not WRITE_BUFFER:
+        return {}
+    return {
+        document: data
+        for (pending_collection, document), (data, _) in WRITE_BUFFER.items()
+        if pending_collection == collection
+    }
+
+def discard_writes():
+    global WRITE_BUFFER
+    if WRITE_BUFFER:
+        message(f"{len(WRITE_BUFFER)} escritas pendentes descartadas.", True)
+    WRITE_BUFFER = None
+
+def write_batches(writes):
+    # Lotes limitados pelo número de escritas e pelo tamanho aproximado dos dados
+    batch = []
+    size = 0
+    for write in writes:
+        write_size = len(repr(write[2]))
+        if batch and (len(batch) >= write_batch_limit or size + write_size > write_batch_bytes):
+            yield batch
+            batch = []
+            size = 0
+        batch.append(write)
+        size += write_size
+    if batch:
+        yield batch
+
+def take_writes():
+    # Esvazia o buffer devolvendo as escritas como (coleção, documento, dados, merge)
+    global WRITE_BUFFER
+    writes = [
+        (collection, document, data, merge)
+        for (collection, document), (data, merge) in (WRITE_BUFFER or {}).items()
+    ]
+    WRITE_BUFFER = None
+    return writes
+
+@traced
+def flush_writes(db):
+    writes = take_writes()
+    if not writes:
+        return 0
+
+    message(f"Gravando {len(writes)} escritas em lote...")
+
+    try:
+        start = time.perf_counter()
+        batches = 0
+        for batch in write_batches(writes):
+            db.commit(batch)
+            batches += 1
+        elapsed = (time.perf_counter() - start) * 1000
+
+        message(f"{len(writes)} escritas confirmadas em {batches} lote(s) em {elapsed:.0f} ms.", True)
+        annotate_span(writes=len(writes), batches=batches)
+        return len(writes)
+
+    except Exception as e:
+        error_message = message(f"Erro ao gravar as escritas em lote: {str(e)}", True)
+        upload_status(db, "final_result", error_message)
+        return
+
+
 # -- collect and save --
+@traced
 def check_data(db):
     message("Verificando se há dados existentes...")
     
     try:
-        doc_ref = db.collection("playlist_data").document(TODAY_STRING)
-        doc = doc_ref.get()
-        if not doc.exists:  # Não há dados no dia atual
+        doc = db.get_record(TODAY_STRING)
+        if doc.data is None:  # Não há dados no dia atual
             return message("Dados ainda não inseridos no banco.")
         
         info_message = message(f"Dados para {TODAY_STRING} já salvos.", True)
@@ -153,11 +544,60 @@ def check_data(db):
         upload_status(db, "final_result", error_message)
         return
 
+@traced
+def check_playlists_data(db, playlist_ids):
+    message("Verificando quais playlists já têm dados hoje...")
+
+    try:
+        doc = db.get_record(TODAY_STRING)
+        saved = (doc.data or {}).get("playlists", {})
+        pending = [playlist_id for playlist_id in playlist_ids if playlist_id not in saved]
+
+        if not pending:
+            info_message = message(f"Dados de todas as playlists para {TODAY_STRING} já salvos.", True)
+            upload_status(db, "final_result", info_message, True)
+        return pending
+
+    except Exception as e:
+        error_message = message(f"Erro ao verificar os dados: {str(e)}", True)
+        upload_status(db, "final_result", error_message)
+        return
+
+def playlist_record(record, playlist_id=None):
+    # Em modo multi-playlist os valores ficam em "playlists.<id>" dentro do documento do dia
+    if not record or playlist_id is None:
+        return record
+    values = (record.get("playlists") or {}).get(playlist_id)
+    if values is None:
+        return
+    return {"date": record.get("date"), **values}
+
+@traced
+def fetch_previous_record(db):
+    message("Buscando o registro anterior mais recente...")
+
+    try:
+        yesterday = (datetime.date.fromisoformat(TODAY_STRING) - datetime.timedelta(days=1)).isoformat()
+        for doc in db.stream_records(until=yesterday, limit=1):
+            message(f"Registro anterior encontrado em {doc.id}.")
+            return {"date": doc.id, **doc.data}
+
+        message("Nenhum registro anterior encontrado.")
+    except Exception as e:
+        message(f"Erro ao buscar o registro anterior: {str(e)}", True)
+
+    return
+
+@traced
 def authenticate_youtube(db, youtube_api_key):
     message("Autenticando conta da API...")
 
     try:
-        authentication = build("youtube", "v3", developerKey=youtube_api_key)
+        # Documento de descoberta embutido no pacote: nenhuma requisição extra na partida
+        discovery = lazy_import("googleapiclient.discovery")
+        authentication = discovery.build(
+            "youtube", "v3", developerKey=youtube_api_key, static_discovery=True, cache_discovery=False
+        )
         message("Autenticação concluída.")
         return authentication
     except Exception as e:
@@ -165,81 +605,429 @@ def authenticate_youtube(db, youtube_api_key):
         upload_status(db, "final_result", error_message)
         return
 
-def get_data(db, youtube_authentication, playlist_id):
+@traced
+def get_data(db, youtube_authentication, playlist_id, workers=None, previous=None, durations=None):
     message(f"Obtendo dados da playlist '{playlist_id}'...")
 
+    if workers is None:
+        workers = duration_workers
+
+    # Totais somados por outro método (minutos arredondados por vídeo) não podem ser copiados
+    previous_fingerprint = None
+    if (previous or {}).get("duration_method") == duration_method:
+        previous_fingerprint = previous.get("fingerprint")
+
+    # Sem um mapa compartilhado, a própria chamada abre e mantém o cache de durações
+    cache = None
+    if durations is None:
+        cache = open_duration_cache(duration_cache_path)
+        durations = load_cached_durations(cache)
+    cached_ids = set(durations) if cache else set()
+    fetched = {}
+
+    # Páginas já listadas hoje ficam salvas: uma nova tentativa continua de onde parou
+    checkpoints = open_checkpoints(checkpoint_path)
+
     try:
-        request = youtube_authentication.playlistItems().list(
-            part="contentDetails",
-            playlistId=playlist_id,
-            maxResults=50
-        )
-        video_ids = []
-        while request:
-            response = request.execute()
-            video_ids.extend(item["contentDetails"]["videoId"] for item in response["items"])
-            request = youtube_authentication.playlistItems().list_next(request, response)
-
-        video_count = len(video_ids)
-        total_minutes = 0
-
-        if video_ids:
-            for i in range(0, len(video_ids), 50):
-                video_request = youtube_authentication.videos().list(
-                    part="contentDetails",
-                    id=','.join(video_ids[i:i + 50])
-                )
-                video_response = video_request.execute()
-                for video in video_response["items"]:
-                    duration = video["contentDetails"]["duration"]
-                    total_minutes += parse_duration_to_minutes(duration)
+        # A impressão digital é calculada enquanto as páginas chegam, sem segurar as buscas de
+        # duração; se a playlist não mudou, os IDs já estão no cache e nenhuma duração é buscada
+        digest = hashlib.sha256()
+        pages = fingerprinted_pages(iter_checkpointed_pages(youtube_authentication, playlist_id, checkpoints), digest)
 
+        if workers > 1:
+            video_ids = get_durations_pipelined(youtube_authentication, pages, workers, durations, fetched)
+        else:
+            video_ids = get_durations_sequential(youtube_authentication, pages, durations, fetched)
+        fingerprint = digest.hexdigest()
+
+        reused_count = sum(1 for video_id in video_ids if video_id in durations)
+        message(f"{len(fetched)} durações buscadas na API, {reused_count} reaproveitadas.")
+        annotate_span(videos=len(video_ids), durations_fetched=len(fetched), durations_reused=reused_count)
+
+        if fingerprint == previous_fingerprint:
+            message(f"Playlist inalterada desde {previous['date']}, reaproveitando os totais anteriores.", True)
+            video_count = previous.get("video_count", 0)
+            total_minutes = previous.get("total_minutes", 0)
+            collect_path = "fast"
+        else:
+            video_count = len(video_ids)
+            total_minutes, report = total_duration_minutes(
+                fetched.get(video_id) or durations.get(video_id) for video_id in video_ids
+            )
+            report_durations(report)
+            collect_path = "full"
+
+        if cache:
+            evict_cached_durations(cache, cached_ids, video_ids)
+        clear_checkpoint(checkpoints, playlist_id)
         message(f"Playlist contém {video_count} vídeos e {total_minutes} minutos no total.")
 
     except Exception as e:
         error_message = message(f"Erro ao buscar os dados da playlist: {str(e)}", True)
         upload_status(db, "final_result", error_message)
-        return None, None
+        return
 
-    return video_count, total_minutes
+    finally:
+        # Durações já obtidas ficam salvas mesmo se a execução falhar no meio
+        if cache:
+            save_cached_durations(cache, fetched)
+            close_duration_cache(cache)
+        durations.update(fetched)
+        close_checkpoints(checkpoints)
+        save_quota_usage(quota_path)
 
-def parse_duration_to_minutes(duration):
-    # Regex para extrair os componentes de tempo do formato ISO 8601
-    pattern = r"P(?:(\d+)D)?T?(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?"
-    match = re.match(pattern, duration)
+    return {
+        "video_count": video_count,
+        "total_minutes": total_minutes,
+        "fingerprint": fingerprint,
+        "collect_path": collect_path,
+        "video_ids": video_ids,
+    }
 
-    if not match:
-        raise ValueError("Formato de duração inválido.")
+def update_fingerprint(digest, video_ids):
+    # Hash da lista ordenada de IDs: qualquer adição, remoção ou reordenação muda o valor
+    for video_id in video_ids:
+        digest.update(video_id.encode())
+        digest.update(b"\n")
+    return digest
+
+def fingerprinted_pages(pages, digest):
+    # Repassa as páginas sem alterá-las, acumulando os IDs na impressão digital
+    for page_ids in pages:
+        update_fingerprint(digest, page_ids)
+        yield page_ids
+
+def iter_playlist_pages(youtube_authentication, playlist_id, page_token=None):
+    # Devolve (IDs da página, token da próxima página); page_token retoma a listagem no meio
+    params = {"pageToken": page_token} if page_token else {}
+    request = youtube_authentication.playlistItems().list(
+        part="contentDetails",
+        playlistId=playlist_id,
+        maxResults=50,
+        **params
+    )
+    while request:
+        response = execute_api_request("playlistItems", request)
+        annotate_span(pages=1)
+        yield [item["contentDetails"]["videoId"] for item in response["items"]], response.get("nextPageToken")
+        request = youtube_authentication.playlistItems().list_next(request, response)
+
+def iter_checkpointed_pages(youtube_authentication, playlist_id, checkpoints):
+    saved = load_checkpoint(checkpoints, playlist_id)
+    for page_ids, _ in saved:
+        yield page_ids
+
+    if saved and saved[-1][1] is None:
+        return  # a listagem já tinha terminado na tentativa anterior
+
+    page_token = saved[-1][1] if saved else None
+    for page_index, (page_ids, next_page_token) in enumerate(
+        iter_playlist_pages(youtube_authentication, playlist_id, page_token), start=len(saved)
+    ):
+        save_checkpoint_page(checkpoints, playlist_id, page_index, page_ids, next_page_token)
+        yield page_ids
+
+def build_durations_request(youtube_authentication, video_ids):
+    return youtube_authentication.videos().list(
+        part="contentDetails",
+        id=','.join(video_ids)
+    )
 
-    days = int(match.group(1)) if match.group(1) else 0
-    hours = int(match.group(2)) if match.group(2) else 0
-    minutes = int(match.group(3)) if match.group(3) else 0
-    seconds = int(match.group(4)) if match.group(4) else 0
+def execute_durations_request(video_request, http=None):
+    video_response = execute_api_request("videos", video_request, http=http)
+    return {video["id"]: video["contentDetails"]["duration"] for video in video_response["items"]}
+
+def thread_http():
+    # httplib2.Http não é thread-safe: cada thread do pool usa sua própria conexão.
+    # build_http aplica o mesmo timeout de socket (60 s) do cliente principal; sem ele uma
+    # conexão parada prenderia a thread e a espera dos lotes indefinidamente
+    if not hasattr(_thread_state, "http"):
+        _thread_state.http = lazy_import("googleapiclient.http").build_http()
+    return _thread_state.http
+
+def execute_durations_request_threaded(video_request):
+    return execute_durations_request(video_request, http=thread_http())
+
+def get_durations_sequential(youtube_authentication, pages, known, fetched):
+    video_ids = []
+    for page_ids in pages:
+        video_ids.extend(page_ids)
+
+    # Só os vídeos fora do cache vão para a API
+    missing = list(dict.fromkeys(video_id for video_id in video_ids if video_id not in known))
+    for i in range(0, len(missing), 50):
+        video_request = build_durations_request(youtube_authentication, missing[i:i + 50])
+        annotate_span(batches=1)
+        fetched.update(execute_durations_request(video_request))
+
+    return video_ids
+
+def get_durations_pipelined(youtube_authentication, pages, workers, known, fetched):
+    message(f"Buscando durações em paralelo ({workers} lotes simultâneos)...")
+
+    video_ids = []
+    missing = []
+    seen = set()
+    pending = set()
+    submitted = 0
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+
+    def collect(futures):
+        for future in futures:
+            pending.discard(future)
+            fetched.update(future.result())
+
+    def submit(batch):
+        # Limita os lotes em voo para não acumular requisições sem limite
+        if len(pending) >= workers * 2:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+        video_request = build_durations_request(youtube_authentication, batch)
+        annotate_span(batches=1)
+        pending.add(executor.submit(execute_durations_request_threaded, video_request))
 
-    # Converte para minutos
-    total_minutes = days * 1440 + hours * 60 + minutes + seconds // 60
-    return total_minutes
+    try:
+        # Cada lote de 50 IDs fora do cache é enviado assim que as páginas que o completam chegam
+        for page_ids in pages:
+            video_ids.extend(page_ids)
+            for video_id in page_ids:
+                if video_id not in known and video_id not in seen:
+                    seen.add(video_id)
+                    missing.append(video_id)
+            while len(missing) - submitted >= 50:
+                submit(missing[submitted:submitted + 50])
+                submitted += 50
+
+        if submitted < len(missing):
+            submit(missing[submitted:])
+
+        collect(list(pending))
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        # Se um lote falhou, os que terminaram bem ainda vão para fetched (e para o cache)
+        for future in pending:
+            if not future.cancelled() and future.exception() is None:
+                fetched.update(future.result())
+
+    return video_ids
+
+
+# -- duration cache --
+def open_duration_cache(path):
+    if not path:
+        return
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        cache = sqlite3.connect(path)
+        cache.execute(
+            "CREATE TABLE IF NOT EXISTS durations ("
+            "video_id TEXT PRIMARY KEY, duration TEXT NOT NULL) WITHOUT ROWID"
+        )
+        return cache
+    except Exception as e:
+        message(f"Erro ao abrir o cache de durações, seguindo sem cache: {str(e)}", True)
+        return
+
+def load_cached_durations(cache):
+    if not cache:
+        return {}
+
+    try:
+        durations = dict(cache.execute("SELECT video_id, duration FROM durations"))
+        message(f"{len(durations)} durações carregadas do cache.")
+        return durations
+    except Exception as e:
+        message(f"Erro ao ler o cache de durações: {str(e)}", True)
+        return {}
+
+def save_cached_durations(cache, durations):
+    if not cache or not durations:
+        return
+
+    try:
+        cache.executemany(
+            "INSERT OR REPLACE INTO durations (video_id, duration) VALUES (?, ?)",
+            durations.items()
+        )
+        cache.commit()
+    except Exception as e:
+        message(f"Erro ao salvar o cache de durações: {str(e)}", True)
+
+def evict_cached_durations(cache, cached_ids, video_ids):
+    # Remove do cache os vídeos que saíram da(s) playlist(s)
+    if not cache:
+        return
+
+    stale = set(cached_ids) - set(video_ids)
+    if not stale:
+        return
+
+    try:
+        cache.executemany("DELETE FROM durations WHERE video_id = ?", ((video_id,) for video_id in stale))
+        cache.commit()
+        message(f"{len(stale)} vídeos removidos do cache de durações.")
+    except Exception as e:
+        message(f"Erro ao limpar o cache de durações: {str(e)}", True)
+
+def close_duration_cache(cache):
+    if cache:
+        cache.close()
+
+
+# -- checkpoints --
+def open_checkpoints(path):
+    if not path:
+        return
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        checkpoints = sqlite3.connect(path)
+        # WAL com synchronous=NORMAL: cada página salva custa uma escrita no log, sem fsync
+        checkpoints.execute("PRAGMA journal_mode=WAL")
+        checkpoints.execute("PRAGMA synchronous=NORMAL")
+        checkpoints.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "playlist_id TEXT NOT NULL, day TEXT NOT NULL, page_index INTEGER NOT NULL, "
+            "video_ids TEXT NOT NULL, next_page_token TEXT, "
+            "PRIMARY KEY (playlist_id, page_index)) WITHOUT ROWID"
+        )
+        # Checkpoints de outros dias descrevem outra playlist: nunca são reaproveitados
+        expired = checkpoints.execute("DELETE FROM pages WHERE day != ?", (TODAY_STRING,)).rowcount
+        checkpoints.commit()
+        if expired:
+            message(f"{expired} páginas de checkpoints de dias anteriores descartadas.")
+        return checkpoints
+    except Exception as e:
+        message(f"Erro ao abrir os checkpoints, seguindo sem retomada: {str(e)}", True)
+        return
+
+def load_checkpoint(checkpoints, playlist_id):
+    # Lista de (IDs da página, token da próxima página) salvas hoje, em ordem
+    if not checkpoints:
+        return []
+
+    try:
+        rows = checkpoints.execute(
+            "SELECT video_ids, next_page_token FROM pages WHERE playlist_id = ? AND day = ? ORDER BY page_index",
+            (playlist_id, TODAY_STRING)
+        ).fetchall()
+    except Exception as e:
+        message(f"Erro ao ler o checkpoint: {str(e)}", True)
+        return []
+
+    pages = [(video_ids.split(",") if video_ids else [], next_page_token) for video_ids, next_page_token in rows]
+    if pages:
+        listed = sum(len(page_ids) for page_ids, _ in pages)
+        message(f"Retomando a playlist '{playlist_id}' do checkpoint: {len(pages)} páginas e {listed} vídeos já listados.", True)
+        annotate_span(resumed_pages=len(pages))
+    return pages
+
+def save_checkpoint_page(checkpoints, playlist_id, page_index, page_ids, next_page_token):
+    if not checkpoints:
+        return
+
+    try:
+        checkpoints.execute(
+            "INSERT OR REPLACE INTO pages (playlist_id, day, page_index, video_ids, next_page_token) VALUES (?, ?, ?, ?, ?)",
+            (playlist_id, TODAY_STRING, page_index, ",".join(page_ids), next_page_token)
+        )
+        checkpoints.commit()
+    except Exception as e:
+        message(f"Erro ao salvar o checkpoint: {str(e)}", True)
+
+def clear_checkpoint(checkpoints, playlist_id):
+    # Coleta concluída: a próxima execução começa do zero
+    if not checkpoints:
+        return
+
+    try:
+        checkpoints.execute("DELETE FROM pages WHERE playlist_id = ?", (playlist_id,))
+        checkpoints.commit()
+    except Exception as e:
+        message(f"Erro ao limpar o checkpoint: {str(e)}", True)
+
+def close_checkpoints(checkpoints):
+    if checkpoints:
+        checkpoints.close()
+
+# Componentes de tempo do formato ISO 8601 (semanas, dias, horas, minutos, segundos)
+DURATION_PATTERN = re.compile(r"P(?:(\d+)W)?(?:(\d+)D)?(?:T(?=\d)(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?")
+DURATION_UNITS = (604800, 86400, 3600, 60, 1)
+
+@lru_cache(maxsize=4096)
+def parse_duration_to_seconds(duration):
+    match = DURATION_PATTERN.fullmatch(duration)
+
+    # "P" sozinho casaria com todos os grupos vazios
+    if not match or duration == "P":
+        raise ValueError(f"Formato de duração inválido: '{duration}'.")
+
+    return sum(int(value) * unit for value, unit in zip(match.groups(), DURATION_UNITS) if value)
+
+def total_duration_minutes(durations):
+    # Soma em segundos exatos e converte para minutos só no final; cada formato distinto
+    # é interpretado uma vez. Durações com semanas ou inválidas são contadas no relatório,
+    # e as inválidas ficam fora da soma em vez de interromper a execução
+    report = {"weeks": 0, "malformed": 0, "examples": []}
+    total_seconds = 0
+    for duration, count in Counter(duration for duration in durations if duration).items():
+        try:
+            total_seconds += parse_duration_to_seconds(duration) * count
+        except (TypeError, ValueError):
+            report["malformed"] += count
+            if len(report["examples"]) < 5:
+                report["examples"].append(str(duration))
+            continue
+        if "W" in duration:
+            report["weeks"] += count
+
+    return round(total_seconds / 60), report
+
+def report_durations(report):
+    if report["weeks"]:
+        message(f"{report['weeks']} durações em semanas (P#W) convertidas para dias.", True)
+    if report["malformed"]:
+        message(f"{report['malformed']} durações em formato inválido ignoradas (ex.: {', '.join(report['examples'])}).", True)
+    annotate_span(durations_weeks=report["weeks"], durations_malformed=report["malformed"])
 
 
 # -- parse and save data --
-def fetch_data(db):
+def fetch_data(db, playlist_id=None, days=None, since=None, until=None):
+    data = fetch_data_many(db, [playlist_id], days, since, until)
+    if data is None:
+        return
+    return data[playlist_id]
+
+@traced
+def fetch_data_many(db, playlist_ids, days=None, since=None, until=None):
+    # days: só os últimos N registros; since/until: intervalo de datas (inclusivo, 'AAAA-MM-DD')
     message("Buscando dados no Firestore...")
     
     try:
-        collection_ref = db.collection("playlist_data")
-        docs = collection_ref.stream()
+        records = query_records(db, days, since, until)
         
-        data = []
-        for doc in docs:
-            doc_data = doc.to_dict()
-            data.append({
-                "date": doc.id,
-                "video_count": doc_data.get("video_count", 0),
-                "total_minutes": doc_data.get("total_minutes", 0)
-            })
-
-        if data:
-            message(f"{len(data)} registros encontrados no Firestore.")
+        # Uma única leitura da coleção atende todas as playlists pedidas
+        data = {playlist_id: [] for playlist_id in playlist_ids}
+        for date, doc_data in records:
+            for playlist_id in playlist_ids:
+                values = playlist_record(doc_data, playlist_id)
+                if values is None:
+                    continue
+                item = {
+                    "date": date,
+                    "video_count": values.get("video_count", 0),
+                    "total_minutes": values.get("total_minutes", 0)
+                }
+                # Adições e remoções exatas, nos dias em que há snapshot dos vídeos
+                if "videos_added" in values:
+                    item["videos_added"] = values["videos_added"]
+                    item["videos_removed"] = values["videos_removed"]
+                data[playlist_id].append(item)
+
+        if any(data.values()):
+            message(f"{sum(len(items) for items in data.values())} registros encontrados no Firestore.")
         else:
             message("Nenhum dado encontrado na coleção.")
     except Exception as e:
@@ -250,6 +1038,25 @@ def fetch_data(db):
     message("Dados encontrados no Firestore.")
     return data
 
+def query_records(db, days=None, since=None, until=None):
+    # Ordenação explícita pela data, feita pelo armazenamento
+    records = [(doc.id, doc.data) for doc in db.stream_records(since, until, days)]
+
+    # Registros gravados nesta execução ainda estão no buffer de escrita
+    pending = {
+        date: data for date, data in buffered_documents("playlist_data").items()
+        if (not since or date >= since) and (not until or date <= until)
+    }
+    if pending:
+        merged = dict(records)
+        for date, data in pending.items():
+            merged[date] = merge_fields(merged.get(date) or {}, data)
+        records = sorted(merged.items())
+        if days:
+            records = records[-days:]
+
+    return records
+
 def parse_data(data):
     message("Separando dados...")
 
@@ -262,8 +1069,8 @@ def parse_data(data):
     }
 
     preprocessed_month_data = {
-        "video_count_points": video_points[-28:],
-        "total_minutes_points": minute_points[-28:]
+        "video_count_points": video_points[-month_points:],
+        "total_minutes_points": minute_points[-month_points:]
     }
 
     message("Dados pré-processados.")
@@ -271,78 +1078,83 @@ def parse_data(data):
 
 
 # -- calc and save data --
-def calculate_changes(values, title):
-    message(f"Calculando mudanças para {title}...")
+def calculate_changes(values, title, windows=None):
+    return calculate_all_changes({title: values}, windows)[title]
+
+def calculate_all_changes(series, windows=None):
+    # Calcula as estatísticas de todas as métricas de uma vez; séries de mesmo tamanho
+    # são empilhadas numa matriz e resolvidas em uma única passada vetorizada
+    if windows is None:
+        windows = change_windows
+
+    results = {}
+    by_length = {}
+    for title, values in series.items():
+        message(f"Calculando mudanças para {title}...")
+        if not len(values):
+            message(f"Nenhum valor para {title} encontrado.")
+            results[title] = {}
+            continue
+        by_length.setdefault(len(values), []).append(title)
+
+    np = lazy_import("numpy")
+    for titles in by_length.values():
+        matrix = np.asarray([series[title] for title in titles])
+        for title, changes in zip(titles, calculate_changes_matrix(matrix, windows)):
+            results[title] = changes
+            message(f"Cálculo para {title} finalizado.")
+
+    return {title: results[title] for title in series}
+
+def calculate_changes_matrix(matrix, windows):
+    # matrix: uma linha por métrica, uma coluna por dia
+    np = lazy_import("numpy")
+    count = matrix.shape[1]
+    changes = np.diff(matrix, axis=1)
+
+    # Somas acumuladas das mudanças positivas e negativas: qualquer janela final
+    # sai da diferença entre dois pontos, sem percorrer a série de novo
+    zeros = np.zeros((matrix.shape[0], 1), dtype=changes.dtype)
+    added_cumsum = np.concatenate([zeros, np.cumsum(np.where(changes > 0, changes, 0), axis=1)], axis=1)
+    removed_cumsum = np.concatenate([zeros, np.cumsum(np.where(changes < 0, changes, 0), axis=1)], axis=1)
+
+    last = matrix[:, -1]
+
+    def window_stats(size):
+        # mudanças dia a dia dentro da janela (até size - 1 mudanças)
+        steps = min(size, count) - 1
+        start = count - 1 - steps
+        added = added_cumsum[:, -1] - added_cumsum[:, start]
+        removed = removed_cumsum[:, -1] - removed_cumsum[:, start]
+        change_sum = last - matrix[:, start]
+        return steps, added, removed, change_sum
 
-    if not values:
-        message(f"Nenhum valor para {title} encontrado.")
-        return {}
+    # diferenças pontuais
+    differences = {"last_day_difference": last - matrix[:, -2] if count > 1 else None}
+    for name, size in windows.items():
+        differences[f"last_{name}_difference"] = last - matrix[:, -size] if count > size else None
+    differences["total_difference"] = last - matrix[:, 0]
 
-    # mudanças dia a dia na última semana (até 7 dias)
-    last_week_changes = [
-        values[-i] - values[-i - 1]
-        for i in range(1, min(7, len(values)))
-    ]
-    last_week_added   = sum(c for c in last_week_changes if c > 0)
-    last_week_removed = sum(c for c in last_week_changes if c < 0)
+    # apontamentos de adições e remoções, e médias
+    stats = {f"last_{name}": window_stats(size) for name, size in windows.items()}
+    stats["total"] = window_stats(count)
 
-    # mudanças dia a dia no último mês (até 28 dias)
-    last_month_changes = [
-        values[-i] - values[-i - 1]
-        for i in range(1, min(28, len(values)))
-    ]
-    last_month_added   = sum(c for c in last_month_changes if c > 0)
-    last_month_removed = sum(c for c in last_month_changes if c < 0)
+    results = []
+    for row in range(matrix.shape[0]):
+        result = {}
+        for key, difference in differences.items():
+            result[key] = difference[row].item() if difference is not None else 0
 
-    # mudanças dia a dia em todo o período
-    total_changes = [
-        values[i] - values[i - 1]
-        for i in range(1, len(values))
-    ]
-    total_added   = sum(c for c in total_changes if c > 0)
-    total_removed = sum(c for c in total_changes if c < 0)
+        for prefix, (steps, added, removed, change_sum) in stats.items():
+            result[f"{prefix}_added"] = added[row].item()
+            result[f"{prefix}_removed"] = removed[row].item()
 
-    # diferenças pontuais
-    last_day_difference    = values[-1] - values[-2] if len(values) > 1 else 0
-    last_week_difference   = values[-1] - values[-7] if len(values) > 7 else 0
-    last_month_difference  = values[-1] - values[-28] if len(values) > 28 else 0
-    total_difference       = values[-1] - values[0]
-
-    # médias
-    last_week_average_change = (
-        round(sum(last_week_changes) / len(last_week_changes), 2)
-        if last_week_changes else 0
-    )
-    last_month_average_change = (
-        round(sum(last_month_changes) / len(last_month_changes), 2)
-        if last_month_changes else 0
-    )
-    total_average_change = (
-        round(sum(total_changes) / len(total_changes), 2)
-        if total_changes else 0
-    )
+        for prefix, (steps, added, removed, change_sum) in stats.items():
+            result[f"{prefix}_average_change"] = round(change_sum[row].item() / steps, 2) if steps else 0
 
-    message(f"Cálculo para {title} finalizado.")
-    return {
-        # diferenças pontuais
-        "last_day_difference": last_day_difference,
-        "last_week_difference": last_week_difference,
-        "last_month_difference": last_month_difference,
-        "total_difference": total_difference,
-
-        # apontamentos de adições e remoções
-        "last_week_added": last_week_added,
-        "last_week_removed": last_week_removed,
-        "last_month_added": last_month_added,
-        "last_month_removed": last_month_removed,
-        "total_added": total_added,
-        "total_removed": total_removed,
-
-        # médias
-        "last_week_average_change": last_week_average_change,
-        "last_month_average_change": last_month_average_change,
-        "total_average_change": total_average_change,
-    }
+        results.append(result)
+
+    return results
 
 def load_change_indicator(values, title):
     message(f"Calculando indicador de mudança para {title}...")
@@ -356,7 +1168,690 @@ def load_change_indicator(values, title):
     return ""
 
 
+# -- history chunks --
+def fetch_history_index(db, playlist_id=None):
+    doc = db.get_document("parsed_data", parsed_document("history_index", playlist_id))
+    return (doc.data or {}).get("chunks", [])
+
+def save_history_chunks(db, chunks, items, start_index, playlist_id=None):
+    # Regrava a partir do bloco start_index; os blocos anteriores ficam intactos
+    chunks = [chunk for chunk in chunks if chunk["index"] < start_index]
+
+    for offset in range(0, len(items), history_chunk_size):
+        chunk_items = items[offset:offset + history_chunk_size]
+        chunk = {
+            "index": start_index + offset // history_chunk_size,
+            "start": chunk_items[0]["date"],
+            "end": chunk_items[-1]["date"],
+            "count": len(chunk_items),
+        }
+        write_document(db, "history_chunks", history_chunk_id(chunk["index"], playlist_id), {
+            **chunk,
+            "data": encode_history_chunk(chunk_items)
+        }, merge=False)
+        chunks.append(chunk)
+
+    upload_calc(db, "parsed_data", parsed_document("history_index", playlist_id), "chunks", chunks)
+    return chunks
+
+@traced
+def update_and_save_history(db, playlist_id=None):
+    message("Atualizando histórico compactado...")
+
+    try:
+        chunks = fetch_history_index(db, playlist_id)
+        if not chunks:
+            return rebuild_history(db, playlist_id)
+
+        # Só o último bloco é relido e regravado junto com os dias novos
+        last = chunks[-1]
+        data = fetch_data(db, playlist_id, since=next_day(last["end"]))
+        if not data:
+            return chunks
+
+        if last["count"] >= history_chunk_size:
+            chunks = save_history_chunks(db, chunks, data, last["index"] + 1, playlist_id)
+        else:
+            doc = db.get_document("history_chunks", history_chunk_id(last["index"], playlist_id))
+            stored = doc.data or {}
+            items = decode_history_chunk(stored["data"], stored["count"]) + data
+            chunks = save_history_chunks(db, chunks, items, last["index"], playlist_id)
+        message(f"{len(data)} dias adicionados ao histórico.")
+        return chunks
+
+    except Exception as e:
+        message(f"Erro ao atualizar o histórico: {str(e)}", True)
+        return
+
+def rebuild_history(db, playlist_id=None, data=None):
+    message("Reconstruindo histórico compactado a partir de todos os registros...", True)
+
+    if data is None:
+        data = fetch_data(db, playlist_id)
+    if not data: return
+
+    chunks = save_history_chunks(db, [], data, 0, playlist_id)
+    message(f"Histórico reconstruído com {len(data)} dias em {len(chunks)} blocos.", True)
+    return chunks
+
+
+# -- rollups --
+rollup_periods = ("weekly", "monthly")
+rollup_stats = ("last", "min", "max", "change")
+
+def rollup_bucket(date, period):
+    day = datetime.date.fromisoformat(date)
+    if period == "weekly":
+        return (day - datetime.timedelta(days=day.weekday())).isoformat()
+    return day.replace(day=1).isoformat()
+
+def new_rollups():
+    # Colunas por período: início do bucket e, por métrica, último valor, mínimo,
+    # máximo e variação líquida em relação ao fechamento do bucket anterior
+    return {
+        "last_date": "",
+        **{
+            period: {
+                "dates": [],
+                **{metric: {stat: [] for stat in rollup_stats} for metric in history_columns}
+            }
+            for period in rollup_periods
+        }
+    }
+
+def update_rollups(rollups, item):
+    # Cada dia novo só mexe no último bucket de cada período (ou abre um novo)
+    if item["date"] <= rollups["last_date"]:
+        return False
+
+    for period in rollup_periods:
+        columns = rollups[period]
+        bucket = rollup_bucket(item["date"], period)
+        new_bucket = not columns["dates"] or columns["dates"][-1] != bucket
+        if new_bucket:
+            columns["dates"].append(bucket)
+
+        for metric in history_columns:
+            value = item[metric]
+            stats = columns[metric]
+            if new_bucket:
+                # Abre a partir do fechamento anterior; o primeiro bucket abre no próprio valor
+                opening = stats["last"][-1] if stats["last"] else value
+                stats["last"].append(value)
+                stats["min"].append(value)
+                stats["max"].append(value)
+                stats["change"].append(value - opening)
+            else:
+                opening = stats["last"][-1] - stats["change"][-1]
+                stats["last"][-1] = value
+                stats["min"][-1] = min(stats["min"][-1], value)
+                stats["max"][-1] = max(stats["max"][-1], value)
+                stats["change"][-1] = value - opening
+
+    rollups["last_date"] = item["date"]
+    return True
+
+def build_rollups(data):
+    rollups = new_rollups()
+    for item in data:
+        update_rollups(rollups, item)
+    return rollups
+
+def fetch_rollups(db, playlist_id=None):
+    doc = db.get_document("parsed_data", parsed_document("rollups", playlist_id))
+    return (doc.data or {}).get("rollups")
+
+@traced
+def update_and_save_rollups(db, playlist_id=None):
+    message("Atualizando resumos semanais e mensais...")
+
+    try:
+        rollups = fetch_rollups(db, playlist_id)
+        if not rollups:
+            return rebuild_rollups(db, playlist_id)
+
+        data = fetch_data(db, playlist_id, since=next_day(rollups["last_date"]))
+        if data is None: return
+
+        updated = sum(update_rollups(rollups, item) for item in data)
+        upload_calc(db, "parsed_data", parsed_document("rollups", playlist_id), "rollups", rollups)
+        message(f"{updated} dias incorporados aos resumos.")
+        return rollups
+
+    except Exception as e:
+        message(f"Erro ao atualizar os resumos: {str(e)}", True)
+        return
+
+def rebuild_rollups(db, playlist_id=None, data=None):
+    message("Reconstruindo resumos semanais e mensais a partir de todos os registros...", True)
+
+    if data is None:
+        data = fetch_data(db, playlist_id)
+    if not data: return
+
+    rollups = build_rollups(data)
+    upload_calc(db, "parsed_data", parsed_document("rollups", playlist_id), "rollups", rollups)
+    message(f"Resumos reconstruídos com {len(rollups['weekly']['dates'])} semanas e {len(rollups['monthly']['dates'])} meses.", True)
+    return rollups
+
+
+# -- membership snapshots --
+def membership_document(date, playlist_id=None):
+    return f"{parsed_document('membership', playlist_id)}_{date}"
+
+def encode_membership(video_ids):
+    # A ordem não importa para saber quem está na playlist; ordenados, os IDs comprimem melhor
+    return zlib.compress("\n".join(sorted(video_ids)).encode(), 9)
+
+def decode_membership(data):
+    text = zlib.decompress(data).decode()
+    return set(text.split("\n")) if text else set()
+
+def fetch_membership_index(db, playlist_id=None):
+    # Lista de {"date", "keyframe"} em ordem de data, um item por snapshot gravado
+    doc = db.get_document("parsed_data", parsed_document("membership_index", playlist_id))
+    return (doc.data or {}).get("snapshots", [])
+
+def load_membership(db, date=None, playlist_id=None):
+    # Vídeos da playlist no último snapshot até date (inclusivo): (data do snapshot, conjunto de IDs)
+    message(f"Reconstruindo os vídeos da playlist em {date or 'sua última data'}...")
+
+    try:
+        index = fetch_membership_index(db, playlist_id)
+        return reconstruct_membership(db, [item for item in index if not date or item["date"] <= date], playlist_id)
+    except Exception as e:
+        message(f"Erro ao reconstruir os vídeos da playlist: {str(e)}", True)
+        return None, None
+
+def reconstruct_membership(db, snapshots, playlist_id=None, cache=None):
+    # Último snapshot completo e as diferenças depois dele: duas leituras em lote
+    if not snapshots:
+        return None, None
+
+    start = max((i for i, item in enumerate(snapshots) if item["keyframe"]), default=0)
+    chain = snapshots[start:]
+    date = chain[-1]["date"]
+
+    cached = load_cached_membership(cache, playlist_id, date)
+    if cached is not None:
+        return date, cached
+
+    docs = db.get_documents([("membership", membership_document(item["date"], playlist_id)) for item in chain])
+    keyframe = docs[0].data
+    parts = [keyframe["data"]]
+    if keyframe["parts"] > 1:
+        document = membership_document(chain[0]["date"], playlist_id)
+        extra = db.get_documents([("membership", f"{document}_p{i:03d}") for i in range(1, keyframe["parts"])])
+        parts += [doc.data["data"] for doc in extra]
+
+    video_ids = set()
+    for part in parts:
+        video_ids |= decode_membership(part)
+    for doc in docs[1:]:
+        video_ids.difference_update(doc.data["removed"])
+        video_ids.update(doc.data["added"])
+
+    return date, video_ids
+
+@traced
+def save_membership(db, video_ids, playlist_id=None):
+    # Grava os vídeos de hoje como diferença do snapshot anterior, com um snapshot completo
+    # a cada membership_keyframe_interval dias; devolve as adições e remoções exatas
+    message("Salvando snapshot dos vídeos da playlist...")
+
+    cache = open_membership_cache(membership_cache_path)
+    try:
+        snapshots = [item for item in fetch_membership_index(db, playlist_id) if item["date"] < TODAY_STRING]
+        previous_date, previous = reconstruct_membership(db, snapshots, playlist_id, cache)
+        current = set(video_ids)
+
+        counts = {}
+        keyframe = previous is None
+        if not keyframe:
+            added = sorted(current - previous)
+            removed = sorted(previous - current)
+            counts = {"videos_added": len(added), "videos_removed": len(removed)}
+
+            last_keyframe = max(item["date"] for item in snapshots if item["keyframe"])
+            age = (datetime.date.fromisoformat(TODAY_STRING) - datetime.date.fromisoformat(last_keyframe)).days
+            # Diferenças grandes demais custam mais que um snapshot completo
+            keyframe = age >= membership_keyframe_interval or len(added) + len(removed) > membership_part_size
+
+            if not keyframe and not added and not removed:
+                message(f"Nenhum vídeo entrou ou saiu desde {previous_date}.")
+                save_cached_membership(cache, playlist_id, previous_date, current)
+                return counts
+
+        document = membership_document(TODAY_STRING, playlist_id)
+        if keyframe:
+            ordered = sorted(current)
+            parts = [ordered[i:i + membership_part_size] for i in range(0, len(ordered), membership_part_size)] or [[]]
+            write_document(db, "membership", document, {
+                "type": "keyframe",
+                "count": len(current),
+                "parts": len(parts),
+                "data": encode_membership(parts[0]),
+            }, merge=False)
+            for i, part in enumerate(parts[1:], start=1):
+                write_document(db, "membership", f"{document}_p{i:03d}", {"data": encode_membership(part)}, merge=False)
+        else:
+            write_document(db, "membership", document, {
+                "type": "delta",
+                "base": previous_date,
+                "count": len(current),
+                "added": added,
+                "removed": removed,
+            }, merge=False)
+
+        snapshots.append({"date": TODAY_STRING, "keyframe": keyframe})
+        upload_calc(db, "parsed_data", parsed_document("membership_index", playlist_id), "snapshots", snapshots)
+        save_cached_membership(cache, playlist_id, TODAY_STRING, current)
+
+        kind = "completo" if keyframe else f"com {counts['videos_added']} adições e {counts['videos_removed']} remoções"
+        message(f"Snapshot {kind} dos {len(current)} vídeos salvo.")
+        return counts
+
+    except Exception as e:
+        # Sem snapshot o dia ainda é salvo, só sem as contagens exatas
+        message(f"Erro ao salvar o snapshot dos vídeos: {str(e)}", True)
+        return {}
+
+    finally:
+        close_membership_cache(cache)
+
+def open_membership_cache(path):
+    # Cópia local do último snapshot: evita reler o snapshot completo e as diferenças a cada execução
+    if not path:
+        return
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        cache = sqlite3.connect(path)
+        cache.execute(
+            "CREATE TABLE IF NOT EXISTS membership ("
+            "playlist_id TEXT PRIMARY KEY, date TEXT NOT NULL, data BLOB NOT NULL) WITHOUT ROWID"
+        )
+        return cache
+    except Exception as e:
+        message(f"Erro ao abrir o cache de snapshots, seguindo sem cache: {str(e)}", True)
+        return
+
+def load_cached_membership(cache, playlist_id, date):
+    # Só vale se for exatamente o snapshot pedido; uma execução descartada deixa o cache à frente
+    if not cache:
+        return
+
+    try:
+        row = cache.execute("SELECT date, data FROM membership WHERE playlist_id = ?", (playlist_id or "",)).fetchone()
+    except Exception as e:
+        message(f"Erro ao ler o cache de snapshots: {str(e)}", True)
+        return
+
+    if row and row[0] == date:
+        message(f"Snapshot de {date} carregado do cache local.")
+        return decode_membership(row[1])
+
+def save_cached_membership(cache, playlist_id, date, video_ids):
+    if not cache:
+        return
+
+    try:
+        cache.execute(
+            "INSERT OR REPLACE INTO membership (playlist_id, date, data) VALUES (?, ?, ?)",
+            (playlist_id or "", date, encode_membership(video_ids))
+        )
+        cache.commit()
+    except Exception as e:
+        message(f"Erro ao salvar o cache de snapshots: {str(e)}", True)
+
+def close_membership_cache(cache):
+    if cache:
+        cache.close()
+
+def membership_diff(db, since, until, playlist_id=None):
+    # Vídeos que entraram e saíram entre duas datas, comparando as duas reconstruções
+    _, before = load_membership(db, since, playlist_id)
+    _, after = load_membership(db, until, playlist_id)
+    if before is None or after is None:
+        return None, None
+    return sorted(after - before), sorted(before - after)
+
+
+# -- rolling aggregates --
+aggregate_metrics = ("video_count", "total_minutes")
+
+def new_aggregates():
+    # Totais acumulados por métrica e um buffer circular com os últimos valores,
+    # suficiente para as janelas de semana/mês e a diferença do último dia
+    return {
+        "last_date": "",
+        "count": 0,
+        "metrics": {
+            metric: {"first": 0, "last": 0, "total_added": 0, "total_removed": 0, "recent": []}
+            for metric in aggregate_metrics
+        },
+        "membership_recent": [],  # {"added", "removed"} exatos por dia, ou None
+    }
+
+def update_aggregates(aggregates, item):
+    # Incorpora um novo dia em O(1); dias já incorporados são ignorados
+    if item["date"] <= aggregates["last_date"]:
+        return False
+
+    ring_size = max(change_windows.values()) + 1
+    exact = membership_counts(item) if aggregates["count"] else None
+    for metric in aggregate_metrics:
+        value = item[metric]
+        state = aggregates["metrics"][metric]
+        if aggregates["count"] == 0:
+            state["first"] = value
+        elif metric == "video_count" and exact:
+            state["total_added"] += exact["added"]
+            state["total_removed"] -= exact["removed"]
+        else:
+            change = value - state["last"]
+            if change > 0:
+                state["total_added"] += change
+            elif change < 0:
+                state["total_removed"] += change
+        state["last"] = value
+        state["recent"] = (state["recent"] + [value])[-ring_size:]
+
+    aggregates["membership_recent"] = (aggregates.get("membership_recent", []) + [exact])[-ring_size:]
+
+    aggregates["last_date"] = item["date"]
+    aggregates["count"] += 1
+    return True
+
+def build_aggregates(data):
+    aggregates = new_aggregates()
+    for item in data:
+        update_aggregates(aggregates, item)
+    return aggregates
+
+def changes_from_aggregates(aggregates):
+    # As janelas saem do buffer circular; os totais, dos acumulados
+    metrics = aggregates["metrics"]
+    changes = calculate_all_changes({metric: metrics[metric]["recent"] for metric in aggregate_metrics})
+
+    count = aggregates["count"]
+    for metric in aggregate_metrics:
+        state = metrics[metric]
+        if not changes[metric]:
+            continue
+        total_difference = state["last"] - state["first"]
+        changes[metric]["total_difference"] = total_difference
+        changes[metric]["total_added"] = state["total_added"]
+        changes[metric]["total_removed"] = state["total_removed"]
+        changes[metric]["total_average_change"] = round(total_difference / (count - 1), 2) if count > 1 else 0
+
+    if changes["video_count"]:
+        apply_membership_counts(changes["video_count"], aggregates.get("membership_recent", []), count)
+    return changes
+
+def membership_counts(item):
+    if "videos_added" not in item:
+        return
+    # Um mapa, não uma lista: o Firestore não aceita listas dentro de listas
+    return {"added": item["videos_added"], "removed": item["videos_removed"]}
+
+def apply_membership_counts(changes, exact, count):
+    # Troca as adições/remoções estimadas pela diferença líquida pelas exatas,
+    # nas janelas em que todos os dias têm snapshot dos vídeos
+    for name, size in change_windows.items():
+        steps = min(size, count) - 1
+        window = exact[-steps:] if steps > 0 else []
+        if steps > 0 and len(window) == steps and all(window):
+            changes[f"last_{name}_added"] = sum(counts["added"] for counts in window)
+            changes[f"last_{name}_removed"] = -sum(counts["removed"] for counts in window)
+
+def exact_totals(data):
+    # Totais de adições/remoções como os agregados calculam: exatos quando há snapshot, líquidos nos demais dias
+    added = removed = 0
+    for previous, item in zip(data, data[1:]):
+        exact = membership_counts(item)
+        if exact:
+            added += exact["added"]
+            removed -= exact["removed"]
+        else:
+            change = item["video_count"] - previous["video_count"]
+            added += max(change, 0)
+            removed += min(change, 0)
+    return added, removed
+
+def fetch_aggregates(db, playlist_id=None):
+    message("Buscando agregados acumulados...")
+
+    try:
+        doc = db.get_document("parsed_data", parsed_document("aggregates", playlist_id))
+        if doc.data is not None:
+            return doc.data.get("aggregates")
+        message("Nenhum agregado salvo.")
+    except Exception as e:
+        message(f"Erro ao buscar os agregados: {str(e)}", True)
+
+    return
+
+def next_day(date):
+    return (datetime.date.fromisoformat(date) + datetime.timedelta(days=1)).isoformat()
+
+@traced
+def update_and_save_aggregates(db, playlist_id=None):
+    message("Atualizando agregados acumulados...")
+
+    aggregates = fetch_aggregates(db, playlist_id)
+    if not aggregates:
+        # Sem agregados salvos, a primeira execução reconstrói a partir do histórico
+        return rebuild_aggregates(db, playlist_id)
+
+    # Normalmente só o dia de hoje é novo; dias perdidos entram aqui também
+    data = fetch_data(db, playlist_id, since=next_day(aggregates["last_date"]))
+    if data is None: return
+
+    updated = sum(update_aggregates(aggregates, item) for item in data)
+    message(f"{updated} dias incorporados aos agregados.")
+
+    upload_calc(db, "parsed_data", parsed_document("aggregates", playlist_id), "aggregates", aggregates)
+    return aggregates
+
+def rebuild_aggregates(db, playlist_id=None, data=None):
+    message("Reconstruindo agregados a partir do histórico completo...", True)
+
+    if data is None:
+        data = fetch_data(db, playlist_id)
+    if not data: return
+
+    aggregates = build_aggregates(data)
+    upload_calc(db, "parsed_data", parsed_document("aggregates", playlist_id), "aggregates", aggregates)
+    message(f"Agregados reconstruídos com {aggregates['count']} dias.", True)
+    return aggregates
+
+def verify_aggregates(db, playlist_id=None):
+    message("Verificando agregados contra o recálculo completo...", True)
+
+    aggregates = fetch_aggregates(db, playlist_id)
+    data = fetch_data(db, playlist_id)
+    if not aggregates or not data:
+        return message("Não há agregados ou dados para verificar.", True)
+
+    expected = calculate_all_changes({metric: [item[metric] for item in data] for metric in aggregate_metrics})
+    if expected["video_count"]:
+        exact = [None] + [membership_counts(item) for item in data[1:]]
+        apply_membership_counts(expected["video_count"], exact, len(data))
+        expected["video_count"]["total_added"], expected["video_count"]["total_removed"] = exact_totals(data)
+    actual = changes_from_aggregates(aggregates)
+
+    mismatches = [
+        f"{metric}.{key}: esperado {value}, agregado {actual[metric].get(key)}"
+        for metric in aggregate_metrics
+        for key, value in expected[metric].items()
+        if actual[metric].get(key) != value
+    ]
+    if aggregates["count"] != len(data):
+        mismatches.append(f"count: esperado {len(data)}, agregado {aggregates['count']}")
+
+    if mismatches:
+        for mismatch in mismatches:
+            message(f"Divergência em {mismatch}", True)
+        return message(f"Agregados divergem em {len(mismatches)} valores.", True)
+
+    return message("Agregados conferem com o recálculo completo.", True)
+
+
+# -- snapshot --
+def configured_snapshot_path():
+    # Lida na hora: o .env só é carregado em load_keys
+    return os.getenv("SNAPSHOT_PATH", snapshot_path)
+
+@traced
+def publish_snapshot(db, path, playlist_ids=None):
+    # Tudo o que o dashboard lê vai para um arquivo único, que ele mapeia em memória
+    if not path: return
+    message("Publicando snapshot do dashboard...")
+
+    try:
+        keys = [("status", "playlist_status")] + [
+            ("parsed_data", parsed_document(name, target))
+            for target in playlist_ids or [None]
+            for name in snapshot_documents
+        ]
+        documents = list(zip(keys, db.get_documents(keys)))
+
+        # Os blocos do histórico listados em cada índice também entram
+        chunk_keys = [
+            ("history_chunks", history_chunk_id(chunk["index"], target))
+            for target in playlist_ids or [None]
+            for (_, doc_id), doc in documents
+            if doc_id == parsed_document("history_index", target) and doc.data
+            for chunk in doc.data.get("chunks", [])
+        ]
+        if chunk_keys:
+            documents += zip(chunk_keys, db.get_documents(chunk_keys))
+
+        version = write_snapshot(path, [
+            (collection, doc_id, doc.data, doc.update_time)
+            for (collection, doc_id), doc in documents
+            if doc.data is not None
+        ])
+        annotate_span(documents=len(documents))
+        return message(f"Snapshot {version} publicado em '{path}' ({os.path.getsize(path) / 1024:.1f} KiB).", True)
+    except Exception as e:
+        message(f"Erro ao publicar o snapshot: {str(e)}", True)
+        return
+
+
+# -- backfill --
+def calcs_history_document(date, playlist_id=None):
+    return f"{parsed_document('calcs', playlist_id)}_{date[:4]}"
+
+def backfill_years(data, since=None, until=None):
+    # Índices (início, fim) dos dias do intervalo, agrupados por ano: cada ano é um documento e uma tarefa
+    years = {}
+    for i, item in enumerate(data):
+        if (not since or item["date"] >= since) and (not until or item["date"] <= until):
+            start, _ = years.get(item["date"][:4], (i, i))
+            years[item["date"][:4]] = (start, i + 1)
+    return list(years.values())
+
+def backfill_views(playlist_id, data):
+    # Roda num processo do pool: recalcula as visões atuais e devolve as escritas, sem gravar
+    begin_writes()
+    _, month_data = parse_data(data)
+    upload_calc(None, "parsed_data", parsed_document("points_array", playlist_id), "month_data", month_data)
+    rebuild_history(None, playlist_id, data)
+    rebuild_rollups(None, playlist_id, data)
+    aggregates = rebuild_aggregates(None, playlist_id, data)
+    metrics = aggregates["metrics"]
+    changes = changes_from_aggregates(aggregates)
+    video_changes, minute_changes = build_calcs(
+        metrics["video_count"]["recent"], metrics["total_minutes"]["recent"],
+        changes["video_count"], changes["total_minutes"]
+    )
+    upload_calc(None, "parsed_data", parsed_document("calcs", playlist_id), "video_changes", video_changes)
+    upload_calc(None, "parsed_data", parsed_document("calcs", playlist_id), "minute_changes", minute_changes)
+    return take_writes()
+
+def backfill_daily_calcs(playlist_id, data, start, end):
+    # Roda num processo do pool: os cálculos de cada dia de data[start:end], como a execução
+    # noturna daquele dia os teria gerado (agregados até o dia anterior + o próprio dia)
+    aggregates = build_aggregates(data[:start])
+    days = {}
+    for item in data[start:end]:
+        update_aggregates(aggregates, item)
+        metrics = aggregates["metrics"]
+        changes = changes_from_aggregates(aggregates)
+        video_changes, minute_changes = build_calcs(
+            metrics["video_count"]["recent"], metrics["total_minutes"]["recent"],
+            changes["video_count"], changes["total_minutes"]
+        )
+        days[item["date"]] = {"video_changes": video_changes, "minute_changes": minute_changes}
+
+    return [("calcs_history", calcs_history_document(data[start]["date"], playlist_id), {"days": days}, True)]
+
+def backfill(args):
+
+    message("Iniciando backfill dos dados derivados...\n", True)
+
+    if args.since and args.until and args.since > args.until:
+        return message(f"--since ({args.since}) é posterior a --until ({args.until}).", True)
+
+    playlist_id, playlist_ids, _, db = init()
+    if not (playlist_id or playlist_ids) or not db: return
+
+    targets = playlist_ids or [None]
+    if args.playlists:
+        selected = parse_playlist_ids(args.playlists)
+        unknown = [target for target in selected if target not in playlist_ids]
+        if unknown:
+            return message(f"Playlists fora de PLAYLIST_IDS: {', '.join(unknown)}.", True)
+        targets = selected
+
+    # Uma única leitura dos registros atende todas as playlists; os agregados precisam do histórico inteiro
+    all_data = fetch_data_many(db, targets)
+    if not all_data: return
+
+    start = time.perf_counter()
+    failed = []
+    begin_writes()
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            futures = {}
+            for target in targets:
+                data = all_data[target]
+                if not data:
+                    message(f"Nenhum registro para {target or 'a playlist'}.", True)
+                    continue
+                futures[executor.submit(backfill_views, target, data)] = (target, "visões atuais")
+                for first, last in backfill_years(data, args.since, args.until):
+                    label = f"{data[first]['date']} a {data[last - 1]['date']}"
+                    futures[executor.submit(backfill_daily_calcs, target, data[:last], first, last)] = (target, label)
+
+            message(f"{len(futures)} tarefas em até {args.workers or os.cpu_count()} processos...", True)
+            for future in as_completed(futures):
+                target, label = futures[future]
+                try:
+                    writes = future.result()
+                except Exception as e:
+                    failed.append(f"{target or 'playlist'} ({label})")
+                    message(f"Erro no backfill de {target or 'playlist'} ({label}): {str(e)}", True)
+                    continue
+                for collection, document, data, merge in writes:
+                    write_document(db, collection, document, data, merge)
+                message(f"Backfill de {target or 'playlist'} ({label}) concluído.")
+    finally:
+        # A versão muda só depois que os derivados estão gravados, e o snapshot já sai com ela
+        flush_writes(db)
+        bump_data_version(db)
+        publish_snapshot(db, configured_snapshot_path(), playlist_ids)
+
+    elapsed = time.perf_counter() - start
+    if failed:
+        return message(f"Backfill finalizado em {elapsed:.1f} s com falha em {len(failed)} tarefas: {', '.join(failed)}.\n", True)
+    return message(f"Backfill finalizado em {elapsed:.1f} s.\n", True)
+
+
 # -- main functions --
+@traced
 def init():
 
     message("Iniciando paramêtros do script...")
@@ -364,23 +1859,29 @@ def init():
     # Inicializa data do dia atual
     set_day()
 
-    playlist_id, youtube_api_key, firebase_credentials_path = load_keys()
+    playlist_id, playlist_ids, youtube_api_key, firebase_credentials_path, sqlite_path = load_keys()
 
-    # Definir ambiente
-    firebase_credentials_path = check_environment(firebase_credentials_path)
-    if not firebase_credentials_path:
-        message("Execução finalizada com falha.", True)
-        return None, None, None
+    if sqlite_path:
+        # Armazenamento local: dispensa as credenciais do Firebase
+        db = init_sqlite(sqlite_path)
+    else:
+        # Definir ambiente
+        firebase_credentials_path = check_environment(firebase_credentials_path)
+        if not firebase_credentials_path:
+            message("Execução finalizada com falha.", True)
+            return None, None, None, None
+
+        # Faz a conexão com o firebase
+        db = init_firestore(firebase_credentials_path)
 
-    # Faz a conexão com o firebase
-    db = init_firestore(firebase_credentials_path)
     if not db:
         message("Execução finalizada com falha.", True)
-        return None, None, None
+        return None, None, None, None
 
     message("Paramêtros inicializados.")
-    return playlist_id, youtube_api_key, db
+    return playlist_id, playlist_ids, youtube_api_key, db
 
+@traced
 def collect_and_save(db, playlist_id, youtube_api_key):
 
     message("Iniciando coleta e salvamento de dados...")
@@ -393,44 +1894,125 @@ def collect_and_save(db, playlist_id, youtube_api_key):
     youtube_authentication = authenticate_youtube(db, youtube_api_key)
     if not youtube_authentication: return
 
+    # Busca o registro anterior para comparar a impressão digital da playlist
+    previous = fetch_previous_record(db)
+
     # Coleta os dados de playlist
-    video_count, total_minutes = get_data(db, youtube_authentication, playlist_id)
-    if not video_count: return
+    result = get_data(db, youtube_authentication, playlist_id, previous=previous)
+    if not result or not result["video_count"]: return
+
+    # Guarda quais vídeos estão na playlist, como diferença do snapshot anterior
+    membership = save_membership(db, result["video_ids"])
 
     # Salva os dados no firebase
-    data_uploaded = upload_data(db, video_count, total_minutes)
+    data_uploaded = upload_data(db, result["video_count"], result["total_minutes"], result["fingerprint"], membership)
     if not data_uploaded: return
 
     # Salva o status de resultado final
-    upload_status(db, "final_result", data_uploaded, True)
+    upload_status(db, "final_result", data_uploaded, True, {"collect_path": result["collect_path"]})
     return message("Fluxo de coletar e salvar dados finalizado.")
 
-def parse_and_save_data(db):
+@traced
+def collect_and_save_many(db, playlist_ids, youtube_api_key):
+
+    message(f"Iniciando coleta e salvamento de {len(playlist_ids)} playlists...")
+
+    # Só coleta as playlists que ainda não têm dados hoje
+    pending = check_playlists_data(db, playlist_ids)
+    if not pending: return
+
+    # Um único cliente do youtube atende todas as playlists
+    youtube_authentication = authenticate_youtube(db, youtube_api_key)
+    if not youtube_authentication: return
+
+    previous = fetch_previous_record(db)
+
+    # Durações compartilhadas: um vídeo presente em várias playlists é buscado uma vez só
+    cache = open_duration_cache(duration_cache_path)
+    durations = load_cached_durations(cache)
+    cached_ids = set(durations)
+
+    results = {}
+    seen_ids = set()
+    try:
+        for playlist_id in pending:
+            result = get_data(
+                db, youtube_authentication, playlist_id,
+                previous=playlist_record(previous, playlist_id),
+                durations=durations
+            )
+            if not result: continue
+            video_ids = result.pop("video_ids")
+            result["membership"] = save_membership(db, video_ids, playlist_id)
+            seen_ids.update(video_ids)
+            results[playlist_id] = result
+    finally:
+        save_cached_durations(cache, {video_id: durations[video_id] for video_id in durations.keys() - cached_ids})
+        # Só dá para saber quais vídeos saíram quando todas as playlists foram lidas
+        if len(results) == len(playlist_ids):
+            evict_cached_durations(cache, cached_ids, seen_ids)
+        close_duration_cache(cache)
+
+    if not results: return
+
+    # Salva os dados de todas as playlists em uma única escrita
+    data_uploaded = upload_playlists_data(db, results)
+    if not data_uploaded: return
+
+    failed = [playlist_id for playlist_id in pending if playlist_id not in results]
+    if failed:
+        data_uploaded = message(f"{data_uploaded} Falha em {len(failed)} playlists: {', '.join(failed)}.", True)
+
+    collect_paths = {playlist_id: result["collect_path"] for playlist_id, result in results.items()}
+    upload_status(db, "final_result", data_uploaded, not failed, {"collect_paths": collect_paths})
+    message("Fluxo de coletar e salvar dados finalizado.")
+    return list(results)
+
+@traced
+def parse_and_save_data(db, playlist_id=None, data=None):
     message("Iniciando salvamento de lista de pontos...")
     
-    data = fetch_data(db)
+    if data is None:
+        data = fetch_data(db, playlist_id, days=month_points)
     if not data: return
 
     full_data, month_data = parse_data(data)
     
-    upload_calc(db, "parsed_data", "points_array", "month_data", month_data)
-    # upload_calc(db, "parsed_data", "points_array", "full_data", full_data)
+    upload_calc(db, "parsed_data", parsed_document("points_array", playlist_id), "month_data", month_data)
+
+    # O histórico completo fica em blocos compactados, fora do documento de pontos,
+    # acompanhado dos resumos semanais e mensais para os gráficos de períodos longos
+    update_and_save_history(db, playlist_id)
+    update_and_save_rollups(db, playlist_id)
     
     message("Fluxo de salvar lista de pontos finalizado.")
     return full_data
 
-def calc_and_save_data(db, data):
-    message("Iniciando salvamento dos cálculos...")
+@traced
+def calc_and_save_aggregates(db, aggregates, playlist_id=None):
+    message("Iniciando salvamento dos cálculos a partir dos agregados...")
 
-    video_points = data["video_count_points"]
-    minute_points = data["total_minutes_points"]
+    metrics = aggregates["metrics"]
+    video_counts = metrics["video_count"]["recent"]
+    total_minutes = metrics["total_minutes"]["recent"]
 
-    video_counts = [pt["y"] for pt in video_points]
-    total_minutes = [pt["y"] for pt in minute_points]
+    changes = changes_from_aggregates(aggregates)
+    return save_calcs(db, video_counts, total_minutes, changes["video_count"], changes["total_minutes"], playlist_id)
 
-    video_changes = calculate_changes(video_counts, "vídeos")
-    minute_changes = calculate_changes(total_minutes, "minutos")
-    
+def save_calcs(db, video_counts, total_minutes, video_changes, minute_changes, playlist_id=None):
+    video_changes, minute_changes = build_calcs(video_counts, total_minutes, video_changes, minute_changes)
+
+    upload_calc(db, "parsed_data", parsed_document("calcs", playlist_id), "video_changes", video_changes)
+    upload_calc(db, "parsed_data", parsed_document("calcs", playlist_id), "minute_changes", minute_changes)
+
+    # Os cálculos de cada dia também ficam guardados, num documento por ano
+    upload_calc(db, "calcs_history", calcs_history_document(TODAY_STRING, playlist_id), "days", {
+        TODAY_STRING: {"video_changes": video_changes, "minute_changes": minute_changes}
+    })
+
+    return message("Fluxo de salvar cálculos finalizado.")
+
+def build_calcs(video_counts, total_minutes, video_changes, minute_changes):
     video_change_indicator = load_change_indicator(video_counts, "vídeos")
     minute_change_indicator = load_change_indicator(total_minutes, "minutos")
     video_changes["change_indicator"] = video_change_indicator
@@ -442,20 +2024,45 @@ def calc_and_save_data(db, data):
     video_changes["current_hours"] = current_hours
     video_changes["current_minutes"] = current_minutes
 
-    minutes_per_video = round(total_minutes[-1] / video_counts[-1])
+    minutes_per_video = round(total_minutes[-1] / video_counts[-1]) if video_counts[-1] else 0
     minute_changes["minutes_per_video"] = minutes_per_video
 
-    upload_calc(db, "parsed_data", "calcs", "video_changes", video_changes)
-    upload_calc(db, "parsed_data", "calcs", "minute_changes", minute_changes)
-
-    message("Fluxo de salvar cálculos finalizado.")
+    return video_changes, minute_changes
 
 def main():
     
     message("Iniciando script...\n", True)
 
-    playlist_id, youtube_api_key, db = init()
-    if not playlist_id or not youtube_api_key or not db: return
+    reset_metrics()
+    started_at = datetime.datetime.now(TIMEZONE).strftime("%H:%M:%S")
+    start = time.perf_counter()
+
+    playlist_id, playlist_ids, youtube_api_key, db = init()
+    message(startup_report(), True)
+    if not (playlist_id or playlist_ids) or not youtube_api_key or not db:
+        write_metrics(metrics_path, started_at, time.perf_counter() - start)
+        return
+
+    # Todas as escritas da execução vão para o Firestore juntas no final
+    begin_writes()
+    try:
+        if playlist_ids:
+            run_many(db, playlist_ids, youtube_api_key)
+        else:
+            run(db, playlist_id, youtube_api_key)
+    except Exception as e:
+        discard_writes()
+        upload_status(db, "final_result", message(f"Erro inesperado na execução: {str(e)}", True))
+        raise
+    finally:
+        flush_writes(db)
+        # Publicado mesmo após falhas: o status da execução também vai para o dashboard
+        publish_snapshot(db, configured_snapshot_path(), playlist_ids)
+        write_metrics(metrics_path, started_at, time.perf_counter() - start)
+
+    message("Script finalizado.\n", True)
+
+def run(db, playlist_id, youtube_api_key):
 
     response = collect_and_save(db, playlist_id, youtube_api_key)
     if not response: return
@@ -463,9 +2070,99 @@ def main():
     data = parse_and_save_data(db)
     if not data: return
 
-    calc_and_save_data(db, data)
+    aggregates = update_and_save_aggregates(db)
+    if not aggregates: return
 
-    message("Script finalizado.\n", True)
+    calc_and_save_aggregates(db, aggregates)
+    return True
+
+def run_many(db, playlist_ids, youtube_api_key):
+
+    collected = collect_and_save_many(db, playlist_ids, youtube_api_key)
+    if not collected: return
+
+    all_data = fetch_data_many(db, collected, days=month_points)
+    if not all_data: return
+
+    for playlist_id in collected:
+        data = parse_and_save_data(db, playlist_id, all_data[playlist_id])
+        if not data: continue
+
+        aggregates = update_and_save_aggregates(db, playlist_id)
+        if not aggregates: continue
+
+        calc_and_save_aggregates(db, aggregates, playlist_id)
+    return True
+
+def maintain(args):
+
+    message("Iniciando manutenção dos dados derivados...\n", True)
+
+    playlist_id, playlist_ids, _, db = init()
+    if not (playlist_id or playlist_ids) or not db: return
+
+    begin_writes()
+    try:
+        for target in playlist_ids or [None]:
+            if args.rebuild_aggregates:
+                rebuild_aggregates(db, target)
+            if args.rebuild_history:
+                rebuild_history(db, target)
+            if args.rebuild_rollups:
+                rebuild_rollups(db, target)
+    finally:
+        flush_writes(db)
+        if args.rebuild_aggregates or args.rebuild_history or args.rebuild_rollups:
+            bump_data_version(db)
+
+    # A verificação lê o que já foi gravado, então vem depois do flush
+    if args.verify_aggregates:
+        for target in playlist_ids or [None]:
+            verify_aggregates(db, target)
+
+    if args.rebuild_aggregates or args.rebuild_history or args.rebuild_rollups or args.publish_snapshot:
+        publish_snapshot(db, configured_snapshot_path(), playlist_ids)
+
+    message("Manutenção finalizada.\n", True)
+
+def iso_date(value):
+    # Datas inválidas param na leitura dos argumentos, antes de qualquer tarefa do backfill
+    try:
+        return datetime.date.fromisoformat(value).isoformat()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"data inválida '{value}', use AAAA-MM-DD")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Coleta e processa os dados das playlists monitoradas.")
+    parser.add_argument("--rebuild-aggregates", action="store_true",
+        help="reconstrói os agregados acumulados a partir do histórico completo")
+    parser.add_argument("--verify-aggregates", action="store_true",
+        help="confere os agregados salvos contra o recálculo completo")
+    parser.add_argument("--rebuild-history", action="store_true",
+        help="regrava o histórico compactado a partir de todos os registros")
+    parser.add_argument("--rebuild-rollups", action="store_true",
+        help="recalcula os resumos semanais e mensais a partir de todos os registros")
+    parser.add_argument("--backfill", action="store_true",
+        help="recalcula em paralelo as visões derivadas e os cálculos de cada dia do intervalo")
+    parser.add_argument("--since", metavar="AAAA-MM-DD", type=iso_date,
+        help="primeiro dia do backfill (padrão: o registro mais antigo)")
+    parser.add_argument("--until", metavar="AAAA-MM-DD", type=iso_date,
+        help="último dia do backfill (padrão: o registro mais recente)")
+    parser.add_argument("--playlists", metavar="IDS",
+        help="playlists do backfill, separadas por vírgula (padrão: todas)")
+    parser.add_argument("--workers", type=int, default=None,
+        help="processos do backfill (padrão: um por CPU)")
+    parser.add_argument("--publish-snapshot", action="store_true",
+        help="publica o snapshot do dashboard a partir dos dados já salvos")
+    return parser.parse_args()
+
+STARTUP["module_seconds"] = round(time.perf_counter() - IMPORT_START, 4)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    args = parse_args()
+    if args.backfill:
+        backfill(args)
+    elif args.rebuild_aggregates or args.verify_aggregates or args.rebuild_history or args.rebuild_rollups or args.publish_snapshot:
+        maintain(args)
+    else:
+        main()
\ No newline at end of file
@@ -0,0 +1,506 @@
+from collections import namedtuple
+from abc import ABC, abstractmethod
+import threading
+import importlib
+import copy
+import datetime
+import tempfile
+import sqlite3
+import base64
+import zlib
+import struct
+import mmap
+import json
+import re
+import time
+import os
+
+# Documento lido do armazenamento: data é None quando o documento não existe
+Document = namedtuple("Document", ["id", "data", "update_time"])
+
+RECORDS_COLLECTION = "playlist_data"
+
+# Cabeçalho do snapshot: identificador do formato, versão e tamanho do índice
+SNAPSHOT_MAGIC = b"YPMSNAP1"
+SNAPSHOT_HEADER = struct.Struct("<8sQQ")
+
+# Importações adiadas, compartilhadas pelo backend e pelo dashboard: googleapiclient, firestore,
+# numpy e plotly só são carregados quando pedidos; module_seconds é preenchido pelo ponto de entrada
+STARTUP = {"module_seconds": None, "imports": {}}
+LOADED_MODULES = {}
+import_lock = threading.Lock()
+
+
+def merge_fields(target, data):
+    # Mesma semântica do set(..., merge=True) do Firestore: mapas são mesclados, o resto é substituído
+    for key, value in data.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            merge_fields(target[key], value)
+        else:
+            target[key] = merge_fields({}, value) if isinstance(value, dict) else value
+    return target
+
+
+def lazy_import(name):
+    # Carrega um módulo pesado na primeira vez que é pedido e guarda quanto tempo levou
+    # (sys.modules não serve de atalho: lá o módulo aparece antes de terminar de carregar)
+    module = LOADED_MODULES.get(name)
+    if module is not None:
+        return module
+    with import_lock:
+        if name not in LOADED_MODULES:
+            start = time.perf_counter()
+            LOADED_MODULES[name] = importlib.import_module(name)
+            STARTUP["imports"][name] = round(time.perf_counter() - start, 4)
+    return LOADED_MODULES[name]
+
+
+def parse_playlist_ids(text):
+    # Aceita IDs separados por vírgula, espaço ou quebra de linha, sem repetições
+    return list(dict.fromkeys(re.split(r"[\s,]+", text.strip()))) if text.strip() else []
+
+def parsed_document(name, playlist_id=None):
+    # Documentos derivados de cada playlist (modo multi-playlist) levam o ID como sufixo
+    return name if playlist_id is None else f"{name}_{playlist_id}"
+
+
+class Storage(ABC):
+    """Operações de armazenamento usadas pelo backend e pelo dashboard.
+
+    Os registros diários ficam na coleção playlist_data, com a data (AAAA-MM-DD) como ID;
+    status, cálculos e demais documentos derivados são acessados por coleção e ID.
+    """
+
+    def get_document(self, collection, doc_id):
+        return self.get_documents([(collection, doc_id)])[0]
+
+    @abstractmethod
+    def get_documents(self, keys):
+        # keys: lista de (coleção, ID); devolve os documentos na mesma ordem
+        ...
+
+    def set_document(self, collection, doc_id, data, merge=True):
+        self.commit([(collection, doc_id, data, merge)])
+
+    @abstractmethod
+    def commit(self, writes):
+        # writes: lista de (coleção, ID, dados, merge) gravados de forma atômica
+        ...
+
+    def get_record(self, date):
+        return self.get_document(RECORDS_COLLECTION, date)
+
+    def upsert_record(self, date, data, merge=True):
+        self.set_document(RECORDS_COLLECTION, date, data, merge)
+
+    @abstractmethod
+    def stream_records(self, since=None, until=None, limit=None):
+        # Registros em ordem de data; since/until inclusivos, limit = só os N mais recentes
+        ...
+
+
+class FirestoreStorage(Storage):
+
+    def __init__(self, client):
+        from google.cloud import firestore
+
+        self.client = client
+        self.firestore = firestore
+
+    def get_documents(self, keys):
+        refs = [self.client.collection(collection).document(doc_id) for collection, doc_id in keys]
+        # get_all não garante a ordem: os resultados são casados pelo caminho
+        snapshots = {doc.reference.path: doc for doc in self.client.get_all(refs)}
+        documents = []
+        for ref in refs:
+            doc = snapshots.get(ref.path)
+            if doc is None or not doc.exists:
+                documents.append(Document(ref.id, None, None))
+            else:
+                documents.append(Document(ref.id, doc.to_dict() or {}, doc.update_time))
+        return documents
+
+    def commit(self, writes):
+        batch = self.client.batch()
+        for collection, doc_id, data, merge in writes:
+            batch.set(self.client.collection(collection).document(doc_id), data, merge=merge)
+        batch.commit()
+
+    def stream_records(self, since=None, until=None, limit=None):
+        collection_ref = self.client.collection(RECORDS_COLLECTION)
+        query = collection_ref
+
+        if since:
+            query = query.where(filter=self.firestore.FieldFilter("__name__", ">=", collection_ref.document(since)))
+        if until:
+            query = query.where(filter=self.firestore.FieldFilter("__name__", "<=", collection_ref.document(until)))
+
+        if not limit:
+            return [Document(doc.id, doc.to_dict(), doc.update_time) for doc in query.order_by("__name__").stream()]
+
+        # Os N mais recentes: ordem decrescente com limite, depois invertida
+        docs = query.order_by("__name__", direction=self.firestore.Query.DESCENDING).limit(limit).stream()
+        records = [Document(doc.id, doc.to_dict(), doc.update_time) for doc in docs]
+        records.reverse()
+        return records
+
+
+class SQLiteStorage(Storage):
+    """Armazenamento local em um único arquivo SQLite, sem rede.
+
+    Os registros diários ficam em uma tabela com a data como chave primária (índice
+    ordenado para leituras por intervalo); os demais documentos, em uma tabela por
+    (coleção, ID). Os dados são guardados como JSON.
+    """
+
+    def __init__(self, path):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS records ("
+                "date TEXT PRIMARY KEY, data TEXT NOT NULL, update_time TEXT NOT NULL) WITHOUT ROWID"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                "collection TEXT NOT NULL, doc_id TEXT NOT NULL, data TEXT NOT NULL, update_time TEXT NOT NULL, "
+                "PRIMARY KEY (collection, doc_id)) WITHOUT ROWID"
+            )
+
+    def get_documents(self, keys):
+        with self.lock:
+            return [Document(doc_id, *self._read(collection, doc_id)) for collection, doc_id in keys]
+
+    def commit(self, writes):
+        update_time = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        with self.lock, self.connection:
+            for collection, doc_id, data, merge in writes:
+                if merge:
+                    current, _ = self._read(collection, doc_id)
+                    data = merge_fields(current or {}, data)
+                if collection == RECORDS_COLLECTION:
+                    self.connection.execute(
+                        "INSERT OR REPLACE INTO records (date, data, update_time) VALUES (?, ?, ?)",
+                        (doc_id, encode_json(data), update_time)
+                    )
+                else:
+                    self.connection.execute(
+                        "INSERT OR REPLACE INTO documents (collection, doc_id, data, update_time) VALUES (?, ?, ?, ?)",
+                        (collection, doc_id, encode_json(data), update_time)
+                    )
+
+    def stream_records(self, since=None, until=None, limit=None):
+        conditions = []
+        params = []
+        if since:
+            conditions.append("date >= ?")
+            params.append(since)
+        if until:
+            conditions.append("date <= ?")
+            params.append(until)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        if limit:
+            sql = f"SELECT date, data, update_time FROM records {where} ORDER BY date DESC LIMIT ?"
+            params.append(limit)
+        else:
+            sql = f"SELECT date, data, update_time FROM records {where} ORDER BY date"
+
+        with self.lock:
+            rows = self.connection.execute(sql, params).fetchall()
+        records = [Document(date, decode_json(data), update_time) for date, data, update_time in rows]
+        if limit:
+            records.reverse()
+        return records
+
+    def _read(self, collection, doc_id):
+        if collection == RECORDS_COLLECTION:
+            row = self.connection.execute(
+                "SELECT data, update_time FROM records WHERE date = ?", (doc_id,)
+            ).fetchone()
+        else:
+            row = self.connection.execute(
+                "SELECT data, update_time FROM documents WHERE collection = ? AND doc_id = ?", (collection, doc_id)
+            ).fetchone()
+        if row is None:
+            return None, None
+        return decode_json(row[0]), row[1]
+
+
+class MemoryStorage(Storage):
+    """Armazenamento em memória, para benchmarks e execuções descartáveis.
+
+    Guarda cópias dos dados (como um banco faria) e conta leituras e escritas.
+    """
+
+    def __init__(self):
+        self.collections = {}
+        self.update_times = {}
+        self.reads = 0
+        self.writes = 0
+        self.lock = threading.Lock()
+
+    def get_documents(self, keys):
+        with self.lock:
+            self.reads += len(keys)
+            return [Document(doc_id, *self._read(collection, doc_id)) for collection, doc_id in keys]
+
+    def commit(self, writes):
+        update_time = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        with self.lock:
+            for collection, doc_id, data, merge in writes:
+                documents = self.collections.setdefault(collection, {})
+                if merge and doc_id in documents:
+                    merge_fields(documents[doc_id], copy.deepcopy(data))
+                else:
+                    documents[doc_id] = copy.deepcopy(data)
+                self.update_times[(collection, doc_id)] = update_time
+                self.writes += 1
+
+    def stream_records(self, since=None, until=None, limit=None):
+        with self.lock:
+            records = self.collections.get(RECORDS_COLLECTION, {})
+            dates = sorted(
+                date for date in records
+                if (not since or date >= since) and (not until or date <= until)
+            )
+            if limit:
+                dates = dates[-limit:]
+            self.reads += len(dates)
+            return [Document(date, *self._read(RECORDS_COLLECTION, date)) for date in dates]
+
+    def _read(self, collection, doc_id):
+        data = self.collections.get(collection, {}).get(doc_id)
+        if data is None:
+            return None, None
+        return copy.deepcopy(data), self.update_times[(collection, doc_id)]
+
+
+class SnapshotStorage(Storage):
+    """Leitura do snapshot publicado pelo backend, mapeado em memória.
+
+    O arquivo tem um cabeçalho, um índice JSON com a posição de cada documento e
+    os documentos em JSON, decodificados só quando lidos. Processos que abrem o mesmo
+    arquivo compartilham as páginas em memória. Quando o backend publica uma versão
+    mais nova (troca atômica do arquivo), a próxima leitura passa a usá-la. Documentos
+    fora do snapshot, ou todos enquanto ele não existir, vêm do armazenamento fallback.
+    O arquivo só pode ser trocado por rename (como em write_snapshot), nunca reescrito
+    no lugar: o mapeamento de quem está lendo aponta para o arquivo antigo.
+    """
+
+    def __init__(self, path, fallback=None):
+        self.path = path
+        self.fallback = fallback
+        self.snapshot = None  # (versão, mmap, índice)
+        self.file_key = None
+        self.lock = threading.Lock()
+        self.refresh()
+
+    @property
+    def version(self):
+        snapshot = self.snapshot
+        return snapshot[0] if snapshot else None
+
+    def refresh(self):
+        # Um stat por leitura: sem mudança no arquivo, nada é relido
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return
+        file_key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if file_key == self.file_key:
+            return
+
+        with self.lock:
+            if file_key == self.file_key:
+                return
+            self.file_key = file_key
+            try:
+                snapshot = open_snapshot(self.path)
+            except (OSError, ValueError, struct.error):
+                # Arquivo inválido: segue com a versão atual até aparecer outro
+                return
+            if snapshot[0] > (self.version or 0):
+                # O mapeamento anterior é liberado quando a última leitura em andamento terminar
+                self.snapshot = snapshot
+
+    def get_documents(self, keys):
+        self.refresh()
+        snapshot = self.snapshot
+
+        documents = [read_snapshot_document(snapshot, collection, doc_id) for collection, doc_id in keys]
+        missing = [i for i, doc in enumerate(documents) if doc is None]
+        if missing:
+            fallback = self.fallback.get_documents([keys[i] for i in missing]) if self.fallback else []
+            for i, doc in zip(missing, fallback):
+                documents[i] = doc
+            for i in missing[len(fallback):]:
+                documents[i] = Document(keys[i][1], None, None)
+        return documents
+
+    def commit(self, writes):
+        # Só o backend publica snapshots (write_snapshot); gravar por aqui ficaria escondido atrás deles
+        raise NotImplementedError("O snapshot é somente leitura; grave no armazenamento de origem.")
+
+    def stream_records(self, since=None, until=None, limit=None):
+        # Os registros diários não fazem parte do snapshot
+        if not self.fallback:
+            return []
+        return self.fallback.stream_records(since, until, limit)
+
+
+def write_snapshot(path, documents, version=None):
+    # documents: lista de (coleção, ID, dados, update_time). O arquivo é montado ao lado do
+    # destino e renomeado por cima dele, então quem lê vê a versão antiga ou a nova inteira
+    version = version or time.time_ns()
+    index = []
+    payload = []
+    offset = 0
+    for collection, doc_id, data, update_time in documents:
+        encoded = encode_json(data).encode()
+        index.append([collection, doc_id, offset, len(encoded), str(update_time) if update_time else None])
+        payload.append(encoded)
+        offset += len(encoded)
+
+    encoded_index = json.dumps(index, separators=(",", ":"), ensure_ascii=False).encode()
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".snapshot-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, version, len(encoded_index)))
+            f.write(encoded_index)
+            for encoded in payload:
+                f.write(encoded)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return version
+
+def open_snapshot(path):
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, version, index_length = SNAPSHOT_HEADER.unpack_from(mapped)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError(f"Arquivo '{path}' não é um snapshot do dashboard.")
+
+    start = SNAPSHOT_HEADER.size + index_length
+    index = {
+        (collection, doc_id): (start + offset, length, update_time)
+        for collection, doc_id, offset, length, update_time in json.loads(mapped[SNAPSHOT_HEADER.size:start])
+    }
+    return version, mapped, index
+
+def read_snapshot_document(snapshot, collection, doc_id):
+    if snapshot is None:
+        return
+    _, mapped, index = snapshot
+    entry = index.get((collection, doc_id))
+    if entry is None:
+        return
+    offset, length, update_time = entry
+    return Document(doc_id, decode_json(mapped[offset:offset + length]), update_time)
+
+
+# Histórico compactado: gravado pelo backend em history_chunks e lido também pelo dashboard
+history_columns = ("video_count", "total_minutes")
+
+def encode_history_chunk(items):
+    # Colunas de inteiros (data como ordinal, vídeos, minutos) codificadas como
+    # deltas em varint zigzag e depois comprimidas com zlib
+    columns = [[datetime.date.fromisoformat(item["date"]).toordinal() for item in items]]
+    columns += [[item[column] for item in items] for column in history_columns]
+
+    encoded = bytearray()
+    for column in columns:
+        previous = 0
+        for value in column:
+            delta = value - previous
+            previous = value
+            zigzag = delta * 2 if delta >= 0 else -delta * 2 - 1
+            while zigzag >= 0x80:
+                encoded.append((zigzag & 0x7F) | 0x80)
+                zigzag >>= 7
+            encoded.append(zigzag)
+
+    return zlib.compress(bytes(encoded), 9)
+
+def decode_history_chunk(data, count):
+    # Inverso de encode_history_chunk: o backend grava e o dashboard lê com o mesmo código
+    encoded = zlib.decompress(data)
+    columns = []
+    position = 0
+    for _ in range(1 + len(history_columns)):
+        column = []
+        previous = 0
+        for _ in range(count):
+            zigzag = 0
+            shift = 0
+            while True:
+                byte = encoded[position]
+                position += 1
+                zigzag |= (byte & 0x7F) << shift
+                shift += 7
+                if byte < 0x80:
+                    break
+            previous += (zigzag >> 1) if not zigzag & 1 else -((zigzag + 1) >> 1)
+            column.append(previous)
+        columns.append(column)
+
+    dates = [datetime.date.fromordinal(ordinal).isoformat() for ordinal in columns[0]]
+    return [
+        {"date": date, **{column: values[i] for column, values in zip(history_columns, columns[1:])}}
+        for i, date in enumerate(dates)
+    ]
+
+def history_chunk_id(index, playlist_id=None):
+    return f"{parsed_document('history', playlist_id)}_{index:05d}"
+
+
+def load_history(db, index, since=None, until=None, playlist_id=None, decoded=None):
+    # Dias do histórico compactado entre since e until (inclusivos). index é a lista de blocos
+    # de parsed_data/history_index: só os que cobrem o intervalo são lidos. decoded (índice do
+    # bloco → dias), se dado, evita reler blocos já decodificados e recebe os lidos agora
+    decoded = {} if decoded is None else decoded
+    wanted = [
+        chunk for chunk in index
+        if (not since or chunk["end"] >= since) and (not until or chunk["start"] <= until)
+    ]
+
+    missing = [chunk["index"] for chunk in wanted if chunk["index"] not in decoded]
+    if missing:
+        keys = [("history_chunks", history_chunk_id(chunk_index, playlist_id)) for chunk_index in missing]
+        for chunk_index, doc in zip(missing, db.get_documents(keys)):
+            if doc.data is None:
+                raise LookupError(f"Bloco '{doc.id}' do histórico não encontrado.")
+            decoded[chunk_index] = decode_history_chunk(doc.data["data"], doc.data["count"])
+
+    return [
+        item
+        for chunk in wanted
+        for item in decoded[chunk["index"]]
+        if (not since or item["date"] >= since) and (not until or item["date"] <= until)
+    ]
+
+def encode_json(data):
+    # bytes (blocos do histórico) não existem em JSON: viram base64 marcado
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False, default=encode_bytes)
+
+def encode_bytes(value):
+    if isinstance(value, bytes):
+        return {"__bytes__": base64.b64encode(value).decode()}
+    raise TypeError(f"Tipo não suportado: {type(value).__name__}")
+
+def decode_json(text):
+    return json.loads(text, object_hook=decode_bytes)
+
+def decode_bytes(value):
+    if len(value) == 1 and "__bytes__" in value:
+        return base64.b64decode(value["__bytes__"])
+    return value
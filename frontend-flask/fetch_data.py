@@ -1,18 +1,75 @@
-from flask import Flask, render_template
+import time
+
+IMPORT_START = time.perf_counter()  # início da carga do módulo, para medir a partida
+
+from flask import Flask, Response, g, jsonify, render_template, request
+from asgiref.wsgi import WsgiToAsgi
 from dotenv import load_dotenv
-from google.cloud import firestore
-import plotly.graph_objects as go
+from functools import lru_cache, partial
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import asyncio
+import hashlib
+import datetime
+import bisect
+import gzip
 import os
-import time
+import sys
 import logging
+import threading
 import pytz
 
+# A camada de armazenamento é compartilhada com o backend
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+from storage import (
+    STARTUP, lazy_import, FirestoreStorage, SQLiteStorage, SnapshotStorage,
+    parse_playlist_ids, parsed_document, history_columns, load_history
+)
+
+try:
+    import brotli
+except ImportError:  # brotli é opcional; sem ele as respostas saem só em gzip
+    brotli = None
+
 # Configurações
 debug = False
 debug_time = 2
+cache_ttl = 60  # segundos entre verificações de versão dos dados
+compress_min_size = 500  # bytes; respostas menores saem sem compressão
+compressed_cache_size = 16  # respostas comprimidas guardadas em memória
+brotli_quality = 5  # 0-11; acima disso o bundle do plotly.js (~4,8 MB) leva segundos para comprimir
+max_points = 5000  # limite do parâmetro points da API
+default_points = 500  # pontos devolvidos por padrão em intervalos longos
+resolution_limits = {"daily": 366, "weekly": 5 * 366}  # dias máximos por resolução; acima disso, mensal
+snapshot_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend", "cache", "dashboard.snapshot")  # publicado pelo backend; SNAPSHOT_PATH substitui, vazio desliga
+part_timeouts = {"documents": 2.0, "graphs": 10.0}  # segundos por parte da página; ao estourar, a parte sai com o valor padrão
+part_workers = 8  # threads para as leituras do armazenamento
+graph_workers = 2  # processos que montam os gráficos em paralelo; 0 monta nas threads
+latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # segundos, para o /metrics
 
 TIMEZONE = pytz.timezone("America/Sao_Paulo")
 TODAY_STRING = ""
+DB = None
+PLAYLIST_IDS = []
+DATA_CACHE = {"playlists": {}, "version": None, "checked_at": 0.0}  # playlists: ID (None no modo de uma playlist) → documentos e ETag
+DOCUMENT_LOADS = {}  # playlist → Future da leitura em andamento, compartilhada pelas requisições
+COMPRESSED_CACHE = {}
+GRAPH_CACHE = {"version": None, "graphs": {}}
+HISTORY_CACHE = {"version": None, "chunks": {}}
+REQUEST_METRICS = {}
+READ_METRICS = {}
+
+db_lock = threading.Lock()
+cache_lock = threading.Lock()
+metrics_lock = threading.Lock()
+compress_lock = threading.Lock()
+graph_lock = threading.Lock()
+
+# Executores próprios: uma parte que estoura o tempo fica para trás sem segurar a resposta
+# (o executor padrão do asyncio é aguardado no fim do loop criado para cada view async)
+EXECUTOR = ThreadPoolExecutor(max_workers=part_workers, thread_name_prefix="dashboard")
+GRAPH_EXECUTOR = None
 
 logging.basicConfig(level=logging.INFO,
     format='%(asctime)s - %(message)s',
@@ -38,11 +95,14 @@ def load_keys():
     
     load_dotenv()
     firebase_credentials_path = os.getenv('FIREBASE_CREDENTIALS_PATH')
+    sqlite_path = os.getenv('SQLITE_PATH')
+    snapshot = os.getenv('SNAPSHOT_PATH', snapshot_path)
+    playlist_ids = parse_playlist_ids(os.getenv('PLAYLIST_IDS', ''))
 
-    return firebase_credentials_path
+    return firebase_credentials_path, sqlite_path, snapshot, playlist_ids
 
 def set_environment(firebase_credentials_path):
-    if os.path.exists(firebase_credentials_path):
+    if firebase_credentials_path and os.path.exists(firebase_credentials_path):
         message(f"Credenciais encontradas em '{firebase_credentials_path}'.")
     else:
         message(f"Não foi possível obter credenciais de autenticação do firebase em '{firebase_credentials_path}', tentando localmente...")
@@ -58,7 +118,8 @@ def set_environment(firebase_credentials_path):
 def init_firestore(firebase_credentials_path):
     message("Conectando ao Firestore...")
     try:
-        db = firestore.Client.from_service_account_json(firebase_credentials_path)
+        firestore = lazy_import("google.cloud.firestore")
+        db = FirestoreStorage(firestore.Client.from_service_account_json(firebase_credentials_path))
         message("Conexão ao Firestore estabelecida.")
     except Exception as e:
         message(f"Erro ao conectar no Firestore: {str(e)}")
@@ -66,41 +127,154 @@ def init_firestore(firebase_credentials_path):
 
     return db
 
+def init_sqlite(sqlite_path):
+    message(f"Abrindo banco local SQLite em '{sqlite_path}'...")
+    try:
+        db = SQLiteStorage(sqlite_path)
+        message("Banco local aberto.")
+    except Exception as e:
+        message(f"Erro ao abrir o banco local: {str(e)}")
+        return
+
+    return db
+
+def init_snapshot(path, fallback):
+    message(f"Abrindo snapshot em '{path}'...")
+    if not os.path.exists(path) and not fallback:
+        message(f"Snapshot '{path}' não encontrado.")
+        return
+
+    # Sem o arquivo ainda, tudo vem do fallback até o backend publicar o primeiro
+    db = SnapshotStorage(path, fallback)
+    message(f"Snapshot aberto (versão {db.version}).")
+    return db
+
 
 # -- load data --
-def fetch_status(db):
+def get_documents(db, playlist_id=None):
+    # Os dados mudam uma vez por dia: dentro do TTL a resposta sai da memória e,
+    # depois dele, só o status é relido para saber se há uma versão nova.
+    # As leituras acontecem fora do cache_lock, que só protege os dicionários
+    with cache_lock:
+        now = time.monotonic()
+        stale = bool(DATA_CACHE["playlists"]) and now - DATA_CACHE["checked_at"] >= cache_ttl
+        if stale:
+            DATA_CACHE["checked_at"] = now  # uma requisição relê o status, as outras seguem com o cache
+
+    if stale:
+        status = read_documents(db, [("status", "playlist_status")])[0].data or {}
+        with cache_lock:
+            if status_version(status) != DATA_CACHE["version"]:
+                DATA_CACHE["playlists"].clear()
+
+    with cache_lock:
+        entry = DATA_CACHE["playlists"].get(playlist_id)
+        if entry is not None:
+            return entry["documents"]
+        load = DOCUMENT_LOADS.get(playlist_id)
+        owner = load is None
+        if owner:
+            load = DOCUMENT_LOADS[playlist_id] = Future()
+
+    if not owner:
+        # Outra requisição já está lendo estes documentos: espera a mesma leitura
+        return load.result()
+
+    try:
+        documents, update_times = fetch_documents(db, playlist_id)
+    except Exception as e:
+        with cache_lock:
+            DOCUMENT_LOADS.pop(playlist_id, None)
+        load.set_exception(e)
+        raise
+
+    version = status_version(documents["playlist_status"])
+    etag = data_etag(version, update_times.get("calcs"), playlist_id)
+    with cache_lock:
+        playlists = DATA_CACHE["playlists"]
+        if version != DATA_CACHE["version"]:
+            # Uma execução nova também invalida as outras playlists
+            playlists.clear()
+            DATA_CACHE["version"] = version
+        playlists[playlist_id] = {"documents": documents, "etag": etag}
+        DATA_CACHE["checked_at"] = now
+        DOCUMENT_LOADS.pop(playlist_id, None)
+    load.set_result(documents)
+    return documents
+
+def status_version(status):
+    # Muda a cada execução diária (final_result_timestamp) e a cada backfill ou reconstrução (data_version)
+    return f"{status.get('final_result_timestamp')}|{status.get('data_version')}"
+
+def cached_etag(playlist_id=None):
+    entry = DATA_CACHE["playlists"].get(playlist_id)
+    return entry["etag"] if entry else None
+
+def read_documents(db, keys):
+    # Toda leitura do armazenamento passa por aqui para ser contada no /metrics
+    for collection, _ in keys:
+        count_reads(collection)
+    return db.get_documents(keys)
+
+def count_reads(collection, count=1):
+    with metrics_lock:
+        READ_METRICS[collection] = READ_METRICS.get(collection, 0) + count
+
+def data_etag(version, calcs_update_time, playlist_id=None):
+    # Muda quando há uma nova execução ou quando os cálculos são regravados
+    key = f"{version}|{calcs_update_time}|{playlist_id}|{plotly_version()}"
+    return hashlib.sha1(key.encode()).hexdigest()
+
+def fetch_documents(db, playlist_id=None):
+    message("Buscando documentos no armazenamento...")
+
+    # Em modo multi-playlist os documentos derivados levam o ID da playlist como sufixo
+    names = ("points_array", "calcs", "history_index", "rollups")
+    keys = [("status", "playlist_status")] + [("parsed_data", parsed_document(name, playlist_id)) for name in names]
+
+    # Uma única chamada em lote no lugar de três leituras seguidas
+    documents = {}
+    update_times = {}
+    for name, doc in zip(("playlist_status",) + names, read_documents(db, keys)):
+        documents[name] = doc.data or {}
+        update_times[name] = doc.update_time
+
+    message("Documentos encontrados no Firestore.")
+    return documents, update_times
+
+def fetch_status(db, playlist_id=None):
     message("Buscando status no Firestore...")
+    try:
+        status = status_fields(get_documents(db, playlist_id))
+        message("Status encontrados no Firestore.")
+        return status
 
-    doc_ref = db.collection("status").document("playlist_status")
-    doc = doc_ref.get().to_dict() or {}
+    except Exception as e:
+        message(f"Erro ao buscar status: {e}")
+        return unavailable_status()
 
-    status = {
+def status_fields(documents):
+    doc = documents["playlist_status"]
+    return {
         "final_result": doc.get("final_result", ""),
         "final_result_timestamp": doc.get("final_result_timestamp", ""),
         "success": doc.get("success", ""),
     }
 
-    message("Status encontrados no Firestore.")
-    return status
-
-def fetch_points(db):
-    message("Buscando dados de pontos do mês...")
-    try:
-        doc_ref = db.collection("parsed_data").document("points_array")
-        doc = doc_ref.get()
-        points = doc.to_dict().get("month_data", {})
-        video_points = points.get("video_count_points", [])
-        minute_points = points.get("total_minutes_points", [])
-        message(f"Obtidos {len(video_points)} pontos de vídeo e {len(minute_points)} pontos de minutos.")
-        return video_points, minute_points
+def unavailable_status():
+    return {"final_result": "Status indisponível.", "final_result_timestamp": "", "success": False}
 
-    except Exception as e:
-        message(f"Erro ao buscar dados do mês: {e}")
-        return [], []
+def month_points(documents):
+    points = documents["points_array"].get("month_data", {})
+    video_points = points.get("video_count_points", [])
+    minute_points = points.get("total_minutes_points", [])
+    message(f"Obtidos {len(video_points)} pontos de vídeo e {len(minute_points)} pontos de minutos.")
+    return video_points, minute_points
 
 def generate_graph(dates, metric, title, color):
     message(f"Gerando gráfico de {title}...")
     try:
+        go = lazy_import("plotly.graph_objects")
         fig = go.Figure()
         fig.add_trace(
             go.Scatter(
@@ -120,22 +294,208 @@ def generate_graph(dates, metric, title, color):
             height=375,
         )
 
-        graph_html = fig.to_html(full_html=False)
+        # O plotly.js é servido uma única vez como arquivo estático (rota plotly_js)
+        graph_html = fig.to_html(full_html=False, include_plotlyjs=False)
         message(f"Gráfico de {title} gerado.")
         return graph_html
 
     except Exception as e:
         message(f"Erro ao gerar gráfico de {title}: {e}")
-        return f"<p>Nenhum dado de {title} para mostrar.</p>"
+        return empty_graph(title)
+
+def empty_graph(title):
+    return f"<p>Nenhum dado de {title} para mostrar.</p>"
+
+def cached_graph(version, title, playlist_id=None):
+    # Os fragmentos dos gráficos só mudam quando os dados mudam de versão
+    with cache_lock:
+        if GRAPH_CACHE["version"] != version:
+            GRAPH_CACHE["version"] = version
+            GRAPH_CACHE["graphs"] = {}
+        return GRAPH_CACHE["graphs"].get((playlist_id, title))
+
+def store_graph(version, title, graph_html, playlist_id=None):
+    with cache_lock:
+        if GRAPH_CACHE["version"] == version:
+            GRAPH_CACHE["graphs"][(playlist_id, title)] = graph_html
+
+def graph_executor():
+    # Montar um gráfico é trabalho de CPU: em threads os dois disputariam o GIL, então
+    # rodam num pool de processos, criado na primeira página que precisa dele
+    global GRAPH_EXECUTOR
+    if not graph_workers:
+        return EXECUTOR
+    with graph_lock:
+        if GRAPH_EXECUTOR is None:
+            # spawn: fork num processo com threads pode herdar locks presos
+            GRAPH_EXECUTOR = ProcessPoolExecutor(graph_workers, mp_context=multiprocessing.get_context("spawn"))
+        return GRAPH_EXECUTOR
+
+def discard_graph_executor():
+    # Um processo que morreu inutiliza o pool; o próximo gráfico cria outro
+    global GRAPH_EXECUTOR
+    with graph_lock:
+        executor, GRAPH_EXECUTOR = GRAPH_EXECUTOR, None
+    if executor is not None:
+        executor.shutdown(wait=False)
+
+@lru_cache(maxsize=1)
+def load_plotlyjs():
+    return lazy_import("plotly.offline").get_plotlyjs()
+
+@lru_cache(maxsize=1)
+def plotly_version():
+    return lazy_import("plotly.offline").get_plotlyjs_version()
+
+def fetch_series(db, since=None, until=None, resolution=None, playlist_id=None):
+    message("Buscando série de pontos...")
+    try:
+        return load_series(db, since, until, resolution, playlist_id)
+
+    except Exception as e:
+        message(f"Erro ao buscar a série de pontos: {e}", True)
+        return
+
+def load_series(db, since=None, until=None, resolution=None, playlist_id=None):
+    # Série em colunas (datas, vídeos, minutos) para o intervalo pedido, na resolução
+    # diária ou a partir dos resumos semanais/mensais calculados pelo backend
+    documents = get_documents(db, playlist_id)
+    index = documents["history_index"].get("chunks", [])
+    rollups = documents["rollups"].get("rollups")
+
+    if resolution is None:
+        resolution = choose_resolution(index, since, until) if (since or until) else "daily"
+    if resolution != "daily" and rollups:
+        return fetch_rollup_series(rollups, resolution, since, until)
+
+    if (since or until) and index:
+        items = fetch_history(db, index, since, until, playlist_id)
+    else:
+        # Sem intervalo (ou sem histórico compactado) vale a janela do mês já pronta
+        month_data = documents["points_array"].get("month_data", {})
+        video_points = month_data.get("video_count_points", [])
+        minute_points = month_data.get("total_minutes_points", [])
+        items = [
+            {"date": video_point["x"], "video_count": video_point["y"], "total_minutes": minute_point["y"]}
+            for video_point, minute_point in zip(video_points, minute_points)
+            if (not since or video_point["x"] >= since) and (not until or video_point["x"] <= until)
+        ]
+
+    message(f"{len(items)} pontos encontrados.")
+    return {
+        "resolution": "daily",
+        "dates": [item["date"] for item in items],
+        **{column: [item[column] for item in items] for column in history_columns},
+    }
+
+def choose_resolution(index, since=None, until=None):
+    # Quanto maior o intervalo, mais grossa a resolução: o custo fica estável com o tempo
+    first = since or (index[0]["start"] if index else None)
+    last = until or (index[-1]["end"] if index else None)
+    if not first or not last:
+        return "daily"
+
+    span = (datetime.date.fromisoformat(last) - datetime.date.fromisoformat(first)).days
+    for resolution, limit in resolution_limits.items():
+        if span <= limit:
+            return resolution
+    return "monthly"
+
+def fetch_rollup_series(rollups, resolution, since=None, until=None):
+    columns = rollups[resolution]
+    # O bucket que contém a data inicial também entra
+    start = bisect.bisect_right(columns["dates"], since) - 1 if since else 0
+    indexes = [
+        i for i in range(max(start, 0), len(columns["dates"]))
+        if not until or columns["dates"][i] <= until
+    ]
+
+    series = {"resolution": resolution, "dates": [columns["dates"][i] for i in indexes]}
+    for metric in history_columns:
+        stats = columns[metric]
+        series[metric] = [stats["last"][i] for i in indexes]
+        for stat in ("min", "max", "change"):
+            series[f"{metric}_{stat}"] = [stats[stat][i] for i in indexes]
+
+    message(f"{len(indexes)} pontos {resolution} encontrados.")
+    return series
+
+def fetch_history(db, index, since=None, until=None, playlist_id=None):
+    # Os blocos lidos ficam em memória, por playlist, até a próxima versão dos dados
+    version = DATA_CACHE["version"]
+    with cache_lock:
+        if HISTORY_CACHE["version"] != version:
+            HISTORY_CACHE["version"] = version
+            HISTORY_CACHE["chunks"] = {}
+        cached = dict(HISTORY_CACHE["chunks"].get(playlist_id, {}))
+
+    loaded = len(cached)
+    try:
+        return load_history(db, index, since, until, playlist_id, cached)
+    finally:
+        count_reads("history_chunks", len(cached) - loaded)
+        with cache_lock:
+            if HISTORY_CACHE["version"] == version:
+                HISTORY_CACHE["chunks"].setdefault(playlist_id, {}).update(cached)
+
+def downsample(series, target, metric="video_count"):
+    # Largest-Triangle-Three-Buckets: reduz a série a target pontos preservando a forma da
+    # curva da métrica principal; as demais colunas seguem os mesmos índices
+    count = len(series["dates"])
+    if not target or count <= target:
+        return series
+
+    if target < 3:
+        # O LTTB precisa de ao menos três pontos; abaixo disso ficam só as pontas (1 = o mais recente)
+        indexes = [count - 1] if target == 1 else [0, count - 1]
+    else:
+        indexes = lttb_indexes(
+            [datetime.date.fromisoformat(date).toordinal() for date in series["dates"]],
+            series[metric],
+            target
+        )
+    return {
+        key: [values[i] for i in indexes] if isinstance(values, list) else values
+        for key, values in series.items()
+    }
+
+def lttb_indexes(xs, ys, threshold):
+    count = len(xs)
+    bucket_size = (count - 2) / (threshold - 2)
+
+    indexes = [0]
+    previous = 0
+    for bucket in range(threshold - 2):
+        # Média do próximo bucket, usada como terceiro vértice do triângulo
+        next_start = int((bucket + 1) * bucket_size) + 1
+        next_end = min(int((bucket + 2) * bucket_size) + 1, count)
+        average_x = sum(xs[next_start:next_end]) / (next_end - next_start)
+        average_y = sum(ys[next_start:next_end]) / (next_end - next_start)
+
+        # Dentro do bucket atual, fica o ponto que forma o maior triângulo
+        start = int(bucket * bucket_size) + 1
+        end = int((bucket + 1) * bucket_size) + 1
+        chosen = start
+        max_area = -1
+        for i in range(start, end):
+            area = abs(
+                (xs[previous] - average_x) * (ys[i] - ys[previous])
+                - (xs[previous] - xs[i]) * (average_y - ys[previous])
+            )
+            if area > max_area:
+                max_area = area
+                chosen = i
+
+        indexes.append(chosen)
+        previous = chosen
+
+    indexes.append(count - 1)
+    return indexes
 
-def fetch_calculations(db):
+def fetch_calculations(db, playlist_id=None):
     message("Buscando informações...")
     try:
-        doc_ref = db.collection("parsed_data").document("calcs")
-        doc = doc_ref.get()
-        data = doc.to_dict() or {}
-        video_changes = data.get("video_changes", {})
-        minute_changes = data.get("minute_changes", {})
+        video_changes, minute_changes = calcs_fields(get_documents(db, playlist_id))
         message("Informações coletadas.")
         return video_changes, minute_changes
     
@@ -143,62 +503,392 @@ def fetch_calculations(db):
         message(f"Erro ao buscar informações: {e}")
         return {}, {}
 
+def calcs_fields(documents):
+    data = documents["calcs"]
+    return data.get("video_changes", {}), data.get("minute_changes", {})
+
 
 # -- main functions --
 def init():
+    global PLAYLIST_IDS
 
     message("Iniciando paramêtros do script...")
 
-    firebase_credentials_path = load_keys()
+    firebase_credentials_path, sqlite_path, snapshot_path, PLAYLIST_IDS = load_keys()
+
+    if sqlite_path:
+        # Armazenamento local: dispensa as credenciais do Firebase
+        db = init_sqlite(sqlite_path)
+    elif snapshot_path and not firebase_credentials_path:
+        # Só o snapshot: o dashboard funciona sem Firestore, lendo apenas o arquivo publicado
+        message("Credenciais do Firebase não configuradas, usando apenas o snapshot.")
+        db = None
+    else:
+        # Definir ambiente
+        firebase_credentials_path = set_environment(firebase_credentials_path)
 
-    # Definir ambiente
-    firebase_credentials_path = set_environment(firebase_credentials_path)
-    if not firebase_credentials_path: return message("Execução finalizada com falha.", True)
+        # Faz a conexão com o firebase
+        db = init_firestore(firebase_credentials_path) if firebase_credentials_path else None
+
+    # Com o snapshot, as leituras saem do arquivo local e o armazenamento só cobre o que faltar nele
+    if snapshot_path:
+        db = init_snapshot(snapshot_path, db)
 
-    # Faz a conexão com o firebase
-    db = init_firestore(firebase_credentials_path)
     if not db: return message("Execução finalizada com falha.", True)
 
     message("Paramêtros inicializados.")
     return db
 
-def load_data(db):
+def get_db():
+    # Uma única conexão com o armazenamento por processo, criado na primeira vez que é pedido
+    global DB
+    with db_lock:
+        if DB is None:
+            try:
+                db = init()
+            except Exception as e:
+                message(f"Erro ao iniciar o armazenamento: {str(e)}", True)
+                return
+            if isinstance(db, str):  # init devolve a mensagem de erro em caso de falha
+                return
+            DB = db
+        return DB
+
+async def load_part(name, function, *args, fallback, executor=None):
+    # Cada parte da página roda fora do loop com o seu próprio limite de tempo; se falhar
+    # ou demorar demais, sai o valor padrão dela e o resto da página segue normalmente
+    loop = asyncio.get_running_loop()
+    try:
+        work = loop.run_in_executor(executor or EXECUTOR, partial(function, *args))
+        return await asyncio.wait_for(work, part_timeouts[name]), True
+    except asyncio.TimeoutError:
+        message(f"Tempo esgotado ao carregar {name}, usando o valor padrão.", True)
+    except BrokenProcessPool as e:
+        message(f"Pool de processos interrompido ao carregar {name}, usando o valor padrão: {e}", True)
+        discard_graph_executor()
+    except Exception as e:
+        message(f"Erro ao carregar {name}, usando o valor padrão: {e}", True)
+    return fallback, False
+
+async def load_graph(version, dates, metric, title, color, playlist_id=None):
+    graph_html = cached_graph(version, title, playlist_id)
+    if graph_html is not None:
+        return graph_html, True
+
+    graph_html, ok = await load_part(
+        "graphs", generate_graph, dates, metric, title, color,
+        fallback=empty_graph(title), executor=graph_executor()
+    )
+    if ok:
+        store_graph(version, title, graph_html, playlist_id)
+    return graph_html, ok
+
+async def load_data(documents, playlist_id=None):
     message("Buscando status e dados...")
 
-    status = fetch_status(db)
+    # Os documentos chegam numa única leitura em lote; daqui em diante só falta montar os gráficos
+    if documents is None:
+        return unavailable_status(), empty_graph("Vídeos"), empty_graph("Minutos"), {}, {}, False
 
-    video_points, minute_points = fetch_points(db)
+    version = status_version(documents["playlist_status"])
+    video_points, minute_points = month_points(documents)
+    video_changes, minute_changes = calcs_fields(documents)
 
     dates = [pt['x'] for pt in video_points]
     video_counts = [pt['y'] for pt in video_points]
     total_minutes = [pt['y'] for pt in minute_points]
 
-    video_graph = generate_graph(dates, video_counts, "Vídeos", "firebrick")
-    minute_graph = generate_graph(dates, total_minutes, "Minutos", "dodgerblue")
-
-    video_changes, minute_changes = fetch_calculations(db)
+    # Os dois gráficos são montados ao mesmo tempo, cada um num processo
+    (video_graph, video_ok), (minute_graph, minute_ok) = await asyncio.gather(
+        load_graph(version, dates, video_counts, "Vídeos", "firebrick", playlist_id),
+        load_graph(version, dates, total_minutes, "Minutos", "dodgerblue", playlist_id),
+    )
 
     message("Status e dados carregados.")
-    return status, video_graph, minute_graph, video_changes, minute_changes
+    return status_fields(documents), video_graph, minute_graph, video_changes, minute_changes, video_ok and minute_ok
+
+
+# -- métricas --
+# Registrados antes da compressão: o after_request daqui roda por último e mede a resposta inteira
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    start = g.get("request_start")
+    if start is None:
+        return response
+
+    elapsed = time.perf_counter() - start
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    key = (request.method, route, str(response.status_code))
+    with metrics_lock:
+        metric = REQUEST_METRICS.setdefault(key, {"buckets": [0] * len(latency_buckets), "count": 0, "sum": 0.0})
+        for i, bound in enumerate(latency_buckets):
+            if elapsed <= bound:
+                metric["buckets"][i] += 1
+        metric["count"] += 1
+        metric["sum"] += elapsed
+    return response
+
+def metric_labels(**labels):
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in labels.items()) + "}"
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def render_metrics():
+    # Formato de texto do Prometheus (histograma cumulativo por rota e contador de leituras)
+    lines = [
+        "# HELP dashboard_request_duration_seconds Latência das requisições do dashboard.",
+        "# TYPE dashboard_request_duration_seconds histogram",
+    ]
+    with metrics_lock:
+        requests = {key: {**metric, "buckets": list(metric["buckets"])} for key, metric in REQUEST_METRICS.items()}
+        reads = dict(READ_METRICS)
+
+    for (method, route, status), metric in sorted(requests.items()):
+        labels = {"method": method, "route": route, "status": status}
+        for bound, count in zip(latency_buckets, metric["buckets"]):
+            lines.append(f"dashboard_request_duration_seconds_bucket{metric_labels(**labels, le=bound)} {count}")
+        lines.append(f"dashboard_request_duration_seconds_bucket{metric_labels(**labels, le='+Inf')} {metric['count']}")
+        lines.append(f"dashboard_request_duration_seconds_sum{metric_labels(**labels)} {metric['sum']:.6f}")
+        lines.append(f"dashboard_request_duration_seconds_count{metric_labels(**labels)} {metric['count']}")
+
+    lines += [
+        "# HELP dashboard_document_reads_total Documentos lidos do armazenamento (Firestore ou SQLite).",
+        "# TYPE dashboard_document_reads_total counter",
+    ]
+    for collection, count in sorted(reads.items()):
+        lines.append(f"dashboard_document_reads_total{metric_labels(collection=collection)} {count}")
+
+    lines += [
+        "# HELP dashboard_startup_seconds Tempo de carga do módulo do dashboard.",
+        "# TYPE dashboard_startup_seconds gauge",
+        f"dashboard_startup_seconds {STARTUP['module_seconds']}",
+        "# HELP dashboard_import_seconds Tempo de cada importação adiada, feita na primeira requisição que a usou.",
+        "# TYPE dashboard_import_seconds gauge",
+    ]
+    for name, seconds in sorted(STARTUP["imports"].items()):
+        lines.append(f"dashboard_import_seconds{metric_labels(module=name)} {seconds}")
+
+    if isinstance(DB, SnapshotStorage):
+        lines += [
+            "# HELP dashboard_snapshot_version Versão do snapshot em uso (0 = ainda sem snapshot).",
+            "# TYPE dashboard_snapshot_version gauge",
+            f"dashboard_snapshot_version {DB.version or 0}",
+        ]
+
+    return "\n".join(lines) + "\n"
+
+@app.route("/metrics")
+def metrics():
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
 
 
 # -- rotas --
 @app.route("/")
-def show_graph():
+async def show_graph():
     message("Carregando dados...")
 
-    db = init()
-    status, video_graph, minute_graph, video_changes, minute_changes = load_data(db)
+    # Uma falha ao abrir o armazenamento cai no mesmo caminho de uma leitura falha: página com os valores padrão
+    db, _ = await load_part("documents", get_db, fallback=None)
+    try:
+        playlist_id = request_playlist()
+    except LookupError as e:
+        return Response(str(e), status=404, mimetype="text/plain")
+
+    # Se o navegador já tem esta versão dos dados, nada de gráficos nem template
+    documents, _ = await load_part("documents", get_documents, db, playlist_id, fallback=None)
+    etag = cached_etag(playlist_id) if documents is not None else None
+    if etag and request.if_none_match.contains_weak(etag):
+        message("Dados inalterados, respondendo 304.")
+        response = Response(status=304)
+        response.set_etag(etag, weak=True)
+        return response
+
+    status, video_graph, minute_graph, video_changes, minute_changes, complete = await load_data(documents, playlist_id)
 
     message("Dados carregados.")
-    return render_template(
+    response = Response(render_template(
         "graph.html",
         status = status,
         video_graph = video_graph,
         minute_graph = minute_graph,
         video_changes = video_changes,
         minute_changes = minute_changes,
-    )
+        plotly_version = plotly_version(),
+    ), mimetype="text/html")
+    if etag and complete:
+        response.set_etag(etag, weak=True)
+        response.headers["Cache-Control"] = "no-cache"
+    else:
+        # Página com partes no valor padrão: não pode ser reaproveitada pelo navegador
+        response.headers["Cache-Control"] = "no-store"
+    return response
+
+@app.route("/static/js/plotly-<version>.min.js")
+def plotly_js(version):
+    # A versão no nome do arquivo permite cache permanente no navegador
+    response = Response(load_plotlyjs(), mimetype="application/javascript")
+    response.set_etag(plotly_version(), weak=True)
+    response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response.make_conditional(request)
+
+def request_playlist():
+    # ?playlist=<id> escolhe uma das playlists de PLAYLIST_IDS; sem ele vale a primeira.
+    # No modo de uma playlist (sem PLAYLIST_IDS) o parâmetro não existe
+    playlist_id = request.args.get("playlist")
+    if not PLAYLIST_IDS:
+        if playlist_id:
+            raise LookupError("Playlist desconhecida: o dashboard monitora uma única playlist.")
+        return
+    if playlist_id is None:
+        return PLAYLIST_IDS[0]
+    if playlist_id not in PLAYLIST_IDS:
+        raise LookupError(f"Playlist desconhecida, use uma de: {', '.join(PLAYLIST_IDS)}.")
+    return playlist_id
+
+# -- api --
+def api_response(payload, playlist_id=None):
+    # ETag da versão dos dados combinada com a consulta: cada recorte tem a sua
+    etag = hashlib.sha1(f"{cached_etag(playlist_id)}|{request.full_path}".encode()).hexdigest()
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(payload)
+    response.set_etag(etag, weak=True)
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["Access-Control-Allow-Origin"] = "*"
+    return response
+
+def api_error(text, status=400):
+    response = jsonify({"error": text})
+    response.status_code = status
+    response.headers["Access-Control-Allow-Origin"] = "*"
+    return response
+
+def parse_date_arg(name):
+    value = request.args.get(name)
+    if value:
+        datetime.date.fromisoformat(value)  # ValueError para datas inválidas
+    return value
+
+@app.route("/api/status")
+def api_status():
+    db = get_db()
+    try:
+        playlist_id = request_playlist()
+    except LookupError as e:
+        return api_error(str(e), 404)
+    return api_response(fetch_status(db, playlist_id), playlist_id)
+
+@app.route("/api/calcs")
+def api_calcs():
+    db = get_db()
+    try:
+        playlist_id = request_playlist()
+    except LookupError as e:
+        return api_error(str(e), 404)
+    video_changes, minute_changes = fetch_calculations(db, playlist_id)
+    return api_response({"video_changes": video_changes, "minute_changes": minute_changes}, playlist_id)
+
+@app.route("/api/points")
+def api_points():
+    try:
+        since = parse_date_arg("from")
+        until = parse_date_arg("to")
+    except ValueError:
+        return api_error("Datas devem estar no formato AAAA-MM-DD.")
+
+    try:
+        target = int(request.args["points"]) if "points" in request.args else None
+    except ValueError:
+        return api_error(f"O parâmetro points deve ser um inteiro entre 1 e {max_points}.")
+
+    metric = request.args.get("metric")
+    if metric and metric not in history_columns:
+        return api_error(f"Métrica inválida, use uma de: {', '.join(history_columns)}.")
+    if target is not None and not 0 < target <= max_points:
+        return api_error(f"O parâmetro points deve estar entre 1 e {max_points}.")
+
+    resolution = request.args.get("resolution")
+    if resolution and resolution not in ("daily", "weekly", "monthly"):
+        return api_error("Resolução inválida, use daily, weekly ou monthly.")
+
+    # Intervalos explícitos têm um teto padrão de pontos
+    if target is None and (since or until):
+        target = default_points
+
+    try:
+        playlist_id = request_playlist()
+    except LookupError as e:
+        return api_error(str(e), 404)
+
+    db = get_db()
+    series = fetch_series(db, since, until, resolution, playlist_id) if db else None
+    if series is None:
+        return api_error("Série indisponível no momento, tente novamente mais tarde.", 503)
+    if metric:
+        series = {key: values for key, values in series.items() if key in ("resolution", "dates") or key.startswith(metric)}
+
+    return api_response(downsample(series, target, metric or "video_count"), playlist_id)
+
+@app.after_request
+def compress_response(response):
+    # As ETags são fracas: o mesmo conteúdo sai em identity, gzip ou br conforme o cliente
+    if response.status_code == 304:
+        response.vary.add("Accept-Encoding")
+        return response
+    if (
+        response.status_code != 200
+        or response.direct_passthrough
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in ("text/html", "text/css", "application/javascript", "application/json")
+    ):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    accepted = request.accept_encodings
+    if brotli and accepted["br"]:
+        encoding = "br"
+    elif accepted["gzip"]:
+        encoding = "gzip"
+    else:
+        return response
+
+    body = response.get_data()
+    if len(body) < compress_min_size:
+        return response
+
+    # Respostas com ETag são iguais até a versão mudar: comprime uma vez e reaproveita
+    etag, _ = response.get_etag()
+    key = (request.full_path, etag, encoding) if etag else None
+    with compress_lock:
+        compressed = COMPRESSED_CACHE.get(key) if key else None
+    if compressed is None:
+        if encoding == "br":
+            compressed = brotli.compress(body, quality=brotli_quality)
+        else:
+            compressed = gzip.compress(body, compresslevel=6)
+        if key:
+            # Verificar, descartar a entrada mais antiga e inserir num passo só entre as threads
+            with compress_lock:
+                if key not in COMPRESSED_CACHE and len(COMPRESSED_CACHE) >= compressed_cache_size:
+                    COMPRESSED_CACHE.pop(next(iter(COMPRESSED_CACHE)))
+                COMPRESSED_CACHE[key] = compressed
+
+    response.set_data(compressed)
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+# Ponto de entrada ASGI (uvicorn fetch_data:asgi_app); app.run() segue servindo via WSGI
+asgi_app = WsgiToAsgi(app)
+
+STARTUP["module_seconds"] = round(time.perf_counter() - IMPORT_START, 4)
+message(f"Dashboard carregado em {STARTUP['module_seconds'] * 1000:.0f} ms.")
 
 if __name__ == "__main__":
+    get_db()
     app.run()
\ No newline at end of file
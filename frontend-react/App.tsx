@@ -71,7 +71,33 @@ function App() {
   const [minuteChanges, setMinuteChanges] = useState<MinuteChanges | null>(null);
 
   useEffect(() => {
+    async function loadFromApi(apiUrl: string) {
+      // Carregar status, pontos e cálculos da API do backend
+      const [statusRes, pointsRes, calcsRes] = await Promise.all([
+        fetch(`${apiUrl}/api/status`),
+        fetch(`${apiUrl}/api/points`),
+        fetch(`${apiUrl}/api/calcs`),
+      ]);
+
+      if (statusRes.ok) setStatus(await statusRes.json() as Status);
+
+      if (pointsRes.ok) {
+        const points: { dates: string[]; video_count: number[]; total_minutes: number[] } = await pointsRes.json();
+        setVideoPoints(points.dates.map((x, i) => ({ x, y: points.video_count[i] })));
+        setMinutePoints(points.dates.map((x, i) => ({ x, y: points.total_minutes[i] })));
+      }
+
+      if (calcsRes.ok) {
+        const data = await calcsRes.json();
+        setVideoChanges(data.video_changes || null);
+        setMinuteChanges(data.minute_changes || null);
+      }
+    }
+
     async function loadData() {
+      const apiUrl = import.meta.env.VITE_API_URL;
+      if (apiUrl) return loadFromApi(apiUrl);
+
       // Carregar status
       const statusRef = doc(db, 'status', 'playlist_status');
       const statusSnap = await getDoc(statusRef);